@@ -1,190 +1,287 @@
 """app.py - Main Flask application for GitIQ"""
 import os
-import json
 import time
 import logging
-import re
-from flask import Flask, request, jsonify, Response, send_from_directory
-from git import Repo, InvalidGitRepositoryError, Actor
-
-from llm_integration import load_llm_config, list_models, count_tokens
-from stream_events import StreamProcessor
-from github_integration import create_github_pr, process_pr_comments
+import atexit
+from contextlib import ExitStack
+from flask import Blueprint, Flask, current_app, request, jsonify, send_from_directory
+from git import InvalidGitRepositoryError, NoSuchPathError
+
+from config import get_config, config_version
+from llm_integration import load_llm_config, list_models, select_model, get_batch_config
+from usage_ledger import model_stats
+from file_scanner import get_scan_config, git_binary_paths, scan_file
+from stream_events import StreamProcessor, try_begin_stream, event_stream_response
+from change_pipeline import (
+    read_files, metadata_messages,
+    parse_metadata_response, fallback_metadata, apply_changes, commit_changes,
+    cleanup_failed_operation, unique_branch_name
+)
+from batch_jobs import start_batch, get_batch, list_batches
+from file_validation import validate_and_repair
+from chunked_edits import generate_changes
+from github_integration import create_github_pr, start_pr_comment_processor, stop_pr_comment_processor
+from repo_registry import init_registry, list_repositories, get_repository, locked_repo
+from tracing import span, set_attributes, record_error, flush as flush_traces
+from http_cache import make_etag, head_token, git_state_token, worktree_token, cached_json_response
+
+logger = logging.getLogger()
+
+api = Blueprint('gitiq', __name__)
+
+# Memoized responses that do not belong to a repository (e.g. /api/models)
+_response_cache = {}
+
+_logging_configured = False
 
 def setup_logging():
+    global _logging_configured
+    if _logging_configured:
+        return logger
     handler = logging.StreamHandler()
     handler.setFormatter(
         logging.Formatter("%(asctime)s - %(name)s - level=%(levelname)s - %(message)s"))
-    logger = logging.getLogger()
     logger.addHandler(handler)
     logger.setLevel(logging.DEBUG)
+    _logging_configured = True
     return logger
 
-logger = setup_logging()
-
-# Initialize Flask app
-app = Flask(__name__, static_url_path='', static_folder='static')
-app.debug = False
-
-# Load configuration
-with open('config.json') as f:
-    config = json.load(f)
-    git_config = config.get('git', {})
-    GIT_BOT = Actor(
-        git_config.get('name', 'GitIQ-bot'),
-        git_config.get('email', 'gitiq-bot@github.com')
-    )
-    GITHUB_ENABLED = config.get('github', {}).get('enabled', False)
-
-# Load LLM configuration
-load_llm_config('config.json')
-
-# Start PR comment processing if GitHub is enabled
-if GITHUB_ENABLED:
-    process_pr_comments()
-
-def get_repo_status():
+def github_enabled():
+    """Whether GitHub integration is enabled in config.json"""
+    return get_config().get('github', {}).get('enabled', False)
+
+def create_app(config_path='config.json'):
+    """
+    Create the GitIQ Flask app.
+
+    Has no side effects beyond reading the config: provider SDKs are loaded on
+    first use and background workers are started separately with
+    start_background_workers().
+    """
+    setup_logging()
+    load_llm_config(config_path)
+    init_registry()
+
+    app = Flask(__name__, static_url_path='', static_folder='static')
+    app.debug = False
+    app.register_blueprint(api)
+    return app
+
+def start_background_workers():
+    """Start background workers (PR comment processing if GitHub is enabled)"""
+    if github_enabled():
+        start_pr_comment_processor()
+
+def stop_background_workers():
+    """Stop background workers and wait for them to exit"""
+    stop_pr_comment_processor()
+    flush_traces()
+
+def get_repo_status(repo_id=None):
     """Get Git repository status information"""
     try:
-        repo = Repo(os.getcwd())
-        return {
-            "is_git_repo": True,
-            "current_branch": repo.active_branch.name
-        }
-    except InvalidGitRepositoryError:
+        with locked_repo(repo_id) as entry:
+            return {
+                "repo": entry['id'],
+                "is_git_repo": True,
+                "current_branch": entry['repo'].active_branch.name
+            }
+    except (InvalidGitRepositoryError, NoSuchPathError):
         return {
+            "repo": get_repository(repo_id)['id'],
             "is_git_repo": False,
             "current_branch": None
         }
 
-def get_file_structure(repo_path="."):
+def get_file_structure(repo_id=None):
     """Get repository file structure with Git status"""
     try:
-        repo = Repo(repo_path)
-        tracked_files = set(repo.git.ls_files().splitlines())
-        untracked_files = set(repo.git.ls_files('--others', '--exclude-standard').splitlines())
-        status = repo.index.diff(None)
-
-        def get_git_status(file_path):
-            if file_path in untracked_files:
-                return "untracked"
-            for diff in status:
-                if diff.a_path == file_path:
-                    if diff.change_type == "D":
-                        return "deleted"
-                    elif diff.change_type == "R":
-                        return "renamed"
-                    else:
-                        return "modified"
-            return "unmodified"
+        with locked_repo(repo_id) as entry:
+            return _scan_file_structure(entry)
+    except (InvalidGitRepositoryError, NoSuchPathError):
+        return []
 
-        result = []
-        for file_path in tracked_files | untracked_files:
-            try:
-                is_binary = False
-                lines = 0
-                tokens = 0
-                diff = None
+def _scan_file_structure(entry):
+    """Scan a locked registry entry; file stats are cached per file by (mtime, size)"""
+    repo = entry['repo']
+    token_cache = entry['cache'].setdefault('file_stats', {})
+    tracked_files = set(repo.git.ls_files().splitlines())
+    untracked_files = set(repo.git.ls_files('--others', '--exclude-standard').splitlines())
+    entry['cache']['file_paths'] = tracked_files | untracked_files
+    status = repo.index.diff(None)
+    scan_config = get_scan_config()
+    binary_paths = git_binary_paths(repo, tracked_files | untracked_files)
+
+    def get_git_status(file_path):
+        if file_path in untracked_files:
+            return "untracked"
+        for diff in status:
+            if diff.a_path == file_path:
+                if diff.change_type == "D":
+                    return "deleted"
+                elif diff.change_type == "R":
+                    return "renamed"
+                else:
+                    return "modified"
+        return "unmodified"
+
+    result = []
+    for file_path in tracked_files | untracked_files:
+        try:
+            diff = None
+
+            full_path = os.path.join(entry['path'], file_path)
+            stat = os.stat(full_path)
+            is_binary_attr = file_path in binary_paths
+            cache_key = (stat.st_mtime_ns, stat.st_size, is_binary_attr, scan_config['max_tokenize_bytes'])
+            cached = token_cache.get(file_path)
+            if cached and cached[0] == cache_key:
+                file_stats = cached[1]
+            else:
+                file_stats = scan_file(full_path, stat.st_size, is_binary_attr, scan_config)
+                token_cache[file_path] = (cache_key, file_stats)
 
+            git_status = get_git_status(file_path)
+            if git_status == "modified":
                 try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        is_binary = '\0' in content
-                        if not is_binary:
-                            lines = len(content.splitlines())
-                            tokens = count_tokens(content)
-                except UnicodeDecodeError:
-                    is_binary = True
-
-                git_status = get_git_status(file_path)
-                if git_status == "modified":
-                    try:
-                        diff = repo.git.diff(file_path)
-                    except Exception:
-                        diff = None
-
-                result.append({
-                    "path": file_path,
-                    "size": os.path.getsize(file_path),
-                    "mtime": int(os.path.getmtime(file_path)),
-                    "is_binary": is_binary,
-                    "lines": lines,
-                    "tokens": tokens,
-                    "git_status": git_status,
-                    "diff": diff
-                })
-            except Exception as e:
-                logger.error(f"Error processing file {file_path}: {str(e)}")
+                    diff = repo.git.diff(file_path)
+                except Exception:
+                    diff = None
+
+            result.append({
+                "path": file_path,
+                "size": stat.st_size,
+                "mtime": int(stat.st_mtime),
+                "is_binary": file_stats["is_binary"],
+                "lines": file_stats["lines"],
+                "tokens": file_stats["tokens"],
+                "tokens_estimated": file_stats["tokens_estimated"],
+                "git_status": git_status,
+                "diff": diff
+            })
+        except Exception as e:
+            logger.error(f"Error processing file {file_path}: {str(e)}")
 
-        return result
-    except InvalidGitRepositoryError:
-        return []
+    # Forget files that no longer exist
+    for file_path in set(token_cache) - (tracked_files | untracked_files):
+        del token_cache[file_path]
 
-def generate_branch_name():
-    """Generate default branch name with timestamp"""
-    return f"GitIQ-{int(time.time())}"
+    return result
 
-def is_valid_branch_name(name):
-    """Validate branch name according to Git naming conventions"""
-    branch_name_pattern = re.compile(r'^(?!/)(?!.*//)(?!.*/$)[\w\-.\/]+$')
-    return bool(branch_name_pattern.match(name)) and len(name) <= 50
+def request_repo_id():
+    """Return the repository id named by the request (?repo= or JSON "repo"), if any"""
+    data = request.get_json(silent=True) if request.is_json else None
+    if isinstance(data, dict) and data.get('repo'):
+        return data['repo']
+    return request.args.get('repo')
 
-def cleanup_failed_operation(repo, original_branch, new_branch_name, change_type):
-    """Clean up after failed operation"""
+def unknown_repo_error(repo_id):
+    """Return a 404 response if repo_id is not a configured repository, else None"""
     try:
-        if original_branch:
-            original_branch.checkout()
-        # Only delete local branch if change_type is 'local'
-        if new_branch_name and new_branch_name in repo.heads:
-            if change_type == 'local':
-                repo.delete_head(new_branch_name, force=True)
-        # Attempt to delete remote branch if change_type is 'github'
-        if change_type == 'github':
-            try:
-                repo.git.push('origin', '--delete', new_branch_name)
-                logger.info(f"Deleted remote branch '{new_branch_name}' from remote 'origin'")
-            except Exception as e:
-                logger.warning(f"Failed to delete remote branch '{new_branch_name}': {str(e)}")
-    except Exception as e:
-        logger.error(f"Failed to cleanup: {str(e)}")
+        get_repository(repo_id)
+    except KeyError as e:
+        return jsonify({"type": "error", "message": str(e.args[0])}), 404
+    return None
 
-@app.route('/')
+@api.route('/')
 def index():
-    return send_from_directory(app.static_folder, 'index.html')
+    return send_from_directory(current_app.static_folder, 'index.html')
 
-@app.route('/api/repo/status')
+@api.route('/api/repo/status')
 def repo_status():
     """Get repository status endpoint"""
-    return jsonify(get_repo_status())
-
-@app.route('/api/files')
+    repo_id = request_repo_id()
+    error = unknown_repo_error(repo_id)
+    if error:
+        return error
+    try:
+        with locked_repo(repo_id) as entry:
+            etag = make_etag('status', head_token(entry['repo']))
+            return cached_json_response(entry['cache'], 'status', etag, lambda: get_repo_status(repo_id))
+    except (InvalidGitRepositoryError, NoSuchPathError):
+        return jsonify(get_repo_status(repo_id))
+
+@api.route('/api/repos')
+def repos():
+    """Get the repositories served by this instance"""
+    return jsonify(list_repositories())
+
+@api.route('/api/files')
 def files():
     """Get file structure endpoint"""
-    return jsonify(get_file_structure())
-
-@app.route('/api/models')
+    repo_id = request_repo_id()
+    error = unknown_repo_error(repo_id)
+    if error:
+        return error
+    try:
+        with locked_repo(repo_id) as entry:
+            repo = entry['repo']
+            scanned = None
+            if 'file_paths' not in entry['cache']:
+                # First request: scan once so the ETag covers every file, and serve that scan
+                scanned = _scan_file_structure(entry)
+            etag = make_etag(
+                'files',
+                git_state_token(repo),
+                worktree_token(entry['path'], entry['cache']['file_paths'])
+            )
+            return cached_json_response(
+                entry['cache'], 'files', etag,
+                lambda: scanned if scanned is not None else _scan_file_structure(entry)
+            )
+    except (InvalidGitRepositoryError, NoSuchPathError):
+        return jsonify([])
+
+@api.route('/api/models')
 def models():
     """Get available LLM models"""
-    return jsonify(list_models())
-
-@app.route('/api/pr/create/stream', methods=['POST'])
+    etag = make_etag('models', config_version())
+    return cached_json_response(_response_cache, 'models', etag, list_models)
+
+@api.route('/api/stats/models')
+def stats_models():
+    """Get per-model latency, time-to-first-token, cost and failure statistics"""
+    model = request.args.get('model')
+    since = request.args.get('since', type=float)
+    window = request.args.get('window', type=int)
+    return jsonify(model_stats(model_name=model, since=since, window=window))
+
+@api.route('/api/pr/create/stream', methods=['POST'])
 def create_pr():
     """Create PR with streaming updates endpoint"""
     data = request.json
     prompt = data.get('prompt')
     selected_files = data.get('selected_files', [])
     context_files = data.get('context_files', [])
-    model = data.get('model', 'gpt-4-turbo-preview')
+    model = select_model(data.get('model'))
     base_branch = data.get('base_branch', 'main')
 
     if not prompt or not selected_files:
         return jsonify({"type": "error", "message": "Missing required fields"}), 400
 
+    repo_id = request_repo_id()
+    error = unknown_repo_error(repo_id)
+    if error:
+        return error
+    entry = get_repository(repo_id)
+
+    if not try_begin_stream():
+        return jsonify({"type": "error", "message": "Server is busy, retry later"}), 503, {"Retry-After": "5"}
+
+    queued_at = time.time()
+
     def generate():
+        # One trace per job; stages, LLM calls, git commands and GitHub calls are its spans
+        with span("job.create_pr", repo=entry['id'], model=model, selected_files=len(selected_files)) as job_span:
+            job_span['attributes']['queue_wait_ms'] = (time.time() - queued_at) * 1000
+            yield from run_job()
+
+    def run_job():
         stream = StreamProcessor()
-        change_type = data.get('change_type', 'github' if GITHUB_ENABLED else 'local')
+        change_type = data.get('change_type', 'github' if github_enabled() else 'local')
+        set_attributes(change_type=change_type)
 
-        if change_type == 'github' and not GITHUB_ENABLED:
+        if change_type == 'github' and not github_enabled():
             message = "GitHub integration is not enabled; creating changes in local branch instead."
             logger.warning(message)
             yield stream.event('warning', {'message': message})
@@ -193,194 +290,84 @@ def create_pr():
         repo = None
         original_branch = None
         new_branch = None
+        repo_locks = ExitStack()
 
         try:
-            # Read files content first
+            # Read files content first. Under the lock, so no other job has its branch
+            # checked out; the new branch starts from the commit the files were read at
             with stream.stage("read_files"):
-                files_content = {}
-                for file_path in selected_files + context_files:
-                    with open(file_path, 'r') as f:
-                        files_content[file_path] = f.read()
+                with locked_repo(entry['id']) as locked:
+                    base_commit = locked['repo'].head.commit
+                    files_content = read_files(entry, selected_files + context_files)
                 yield stream.event("info", {"message": f"Read {len(files_content)} files"})
 
             # Generate changes first, before creating any branches
             with stream.stage("generate_changes"):
-                changes_response = stream.chat(
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": """Generate changes for the specified files based on the prompt. You need to return the ENTIRE updated file(s). Follow the style guide and don't make another other changes, removing comments, etc.
-* Do NOT add comments like \" # Rest of the functions remain the same ... \"
-* Do NOT remove unrelated comments in the code
-Return ONLY a JSON object with the following structure, no additional next or content before or after the JSON as follows, making sure the output is VALID JSON escaping newlines as \\n, etc:
-{
-  \"changes\": {
-    \"file_path.txt\": \"new_content based on 'Requested changes' user prompt\",
-    ...
-  },
-  \"new_files\": {
-    \"new_file_path.txt\": \"content of the new file\",
-    ...
-  },
-  \"summary\": \"detailed description of changes made\"
-}"""
-                        },
-                        {
-                            "role": "user",
-                            "content": f"Files to modify:\n{json.dumps(files_content, indent=2)}\n\nRequested changes:\n{prompt}"
-                        }
-                    ],
-                    model_name=model,
-                    json_output=True,
-                    extract_code_block=True
+                changes, new_files, summary = generate_changes(
+                    files_content, selected_files, prompt, model, stats_queue=stream.stats_queue
                 )
-
-                if not isinstance(changes_response, dict) or "changes" not in changes_response:
-                    error_message = changes_response if isinstance(changes_response, str) else "Invalid response format from LLM"
-                    logger.error(f"Bad changes response: {error_message}")
-                    raise ValueError(error_message)
-
-                changes = changes_response["changes"]
-                new_files = changes_response.get("new_files", {})
-                summary = changes_response.get("summary", "No summary provided")
                 yield stream.event("info", {"message": "Changes generated"})
 
+            # Check the generated files and repair broken ones before anything is written
+            with stream.stage("validate_changes"):
+                report = validate_and_repair(
+                    files_content, changes, new_files, selected_files, prompt, model,
+                    root=entry['path'], stats_queue=stream.stats_queue
+                )
+                if report["repaired"]:
+                    yield stream.event("warning", {"message": f"Repaired files that failed validation: {', '.join(report['repaired'])}"})
+                for path, error in report["errors"].items():
+                    yield stream.event("warning", {"message": f"{path} still fails validation: {error}"})
+                yield stream.event("info", {"message": f"Validated {report['checked']} files"})
+
             # Generate branch name, PR title, commit message, and PR description based on the changes
             with stream.stage("generate_metadata"):
                 try:
                     branch_description_commit = stream.chat(
-                        messages=[
-                            {
-                                "role": "system",
-                                "content": """Return ONLY a JSON object with the following structure, no additional text or content before or after the JSON as follows, making sure the output is VALID JSON escaping newlines as \\n, etc:
-{
-  \"branch_name\": \"feature-name\",
-  \"pr_title\": \"Descriptive PR title\",
-  \"pr_description\": \"Full PR description in markdown\",
-  \"commit_message\": \"Commit message following best practices, first line summary (<72 chars), then blank line, then details\"
-}
-Branch name must:
-- Use only lowercase letters, numbers, hyphens, and underscores
-- Be descriptive of the changes made
-- Maximum 50 characters
-- Use snake_case for multiple words (e.g., update_auth_system)
-
-PR title should:
-- Be descriptive and concise
-- Use spaces and capitalization as appropriate
-- Not have the same restrictions as branch names
-- Should not exceed 72 characters
-
-Commit message should:
-- Be in present tense
-- First line summary less than 72 characters
-- Second line should be blank
-- Following lines can include detailed description
-- The commit message should be formatted as per the following example:
-
-[First line summary]
-
-Prompt: [Original prompt]
-
-Description: [Detailed description]
-
-PR description should include:
-
-## Prompt
-[Original prompt]
-
-## Summary of Changes
-[Summary of changes]
-
-### Technical Details
-[Technical details of the changes]
-
-### Files Modified
-- [File 1]
-- [File 2]
-"""
-                            },
-                            {
-                                "role": "user",
-                                "content": f"Prompt: {prompt}\n\nChanges summary: {summary}\n\nFiles modified:\n{list(changes.keys()) + list(new_files.keys())}"
-                            }
-                        ],
+                        messages=metadata_messages(prompt, summary, list(changes.keys()) + list(new_files.keys())),
                         model_name=model,
                         json_output=True,
                         extract_code_block=True
                     )
-
-                    if not isinstance(branch_description_commit, dict):
-                        logger.error(f"Bad branch/description/commit response: {str(branch_description_commit)}")
-                        raise ValueError("Invalid response format from LLM")
-
-                    generated_branch_name = branch_description_commit.get("branch_name", "").strip()
-                    # Validate the generated branch name
-                    if not is_valid_branch_name(generated_branch_name):
-                        error_message = f"Invalid branch name generated: {generated_branch_name}. Using fallback."
-                        logger.error(error_message)
-                        yield stream.event("error", {"message": error_message})
-                        generated_branch_name = ""
+                    metadata = parse_metadata_response(branch_description_commit, summary)
+                    if metadata["branch_name_error"]:
+                        yield stream.event("error", {"message": metadata["branch_name_error"]})
                     else:
-                        yield stream.event("info", {"message": f"Generated branch name: {generated_branch_name}"})
-
-                    # Build the final branch name
-                    branch_name = f"GitIQ{('-' + generated_branch_name) if generated_branch_name else ''}-{int(time.time())}"
-
-                    pr_title = branch_description_commit.get("pr_title", f"GitIQ: {generated_branch_name if generated_branch_name else branch_name}")
-
-                    pr_description = branch_description_commit.get("pr_description", summary)
-                    commit_message = branch_description_commit.get("commit_message", pr_description.split('\n')[0])
+                        yield stream.event("info", {"message": f"Generated branch name: {metadata['generated_branch_name']}"})
 
                 except Exception as e:
                     error_message = f"Error generating branch name/description/commit message: {str(e)}. Using fallback."
                     logger.error(error_message)
                     yield stream.event("error", {"message": error_message})
-                    branch_name = generate_branch_name()
-                    pr_title = f"GitIQ: {branch_name}"
-                    pr_description = f"## Changes\n{summary}"
-                    commit_message = summary
+                    metadata = fallback_metadata(summary)
 
+                branch_name = metadata["branch_name"]
+                generated_branch_name = metadata["generated_branch_name"]
+                pr_title = metadata["pr_title"]
+                pr_description = metadata["pr_description"]
+                commit_message = metadata["commit_message"]
                 yield stream.event("info", {"message": "Branch name, commit message, and PR description generated"})
 
-            # Now that we have the changes, create and checkout the branch
-            repo = Repo(os.getcwd())
+            # Now that we have the changes, lock the repository until we are done with
+            # the working tree, then create and checkout the branch
+            repo = repo_locks.enter_context(locked_repo(entry['id']))['repo']
             original_branch = repo.active_branch
 
             with stream.stage("create_branch"):
-                new_branch = repo.create_head(branch_name)
+                # Concurrent jobs can get the same name within one second
+                branch_name = unique_branch_name(repo, branch_name)
+                new_branch = repo.create_head(branch_name, base_commit)
                 new_branch.checkout()
                 yield stream.event("info", {"message": f"Created branch: {branch_name}"})
 
             # Apply changes
             with stream.stage("apply_changes"):
-                modified_files = []
-                for file_path, content in changes.items():
-                    if file_path in selected_files:  # Only modify selected files
-                        logger.info(f"modified file: {file_path}")
-                        with open(file_path, 'w') as f:
-                            f.write(content)
-                        modified_files.append(file_path)
-                
-                # Create new files
-                for file_path, content in new_files.items():
-                    logger.info(f"created new file: {file_path}")
-                    with open(file_path, 'w') as f:
-                        f.write(content)
-                    modified_files.append(file_path)
-                    repo.index.add([file_path])  # Add new file to git
-
+                modified_files = apply_changes(entry, repo, changes, new_files, selected_files)
                 yield stream.event("info", {"message": f"Modified {len(modified_files)} files"})
 
             # Commit changes
             with stream.stage("commit_changes"):
-                commit_message_with_model = f"{commit_message}\n\nModel: {model}"
-                repo.index.add(modified_files)
-                repo.index.commit(
-                    commit_message_with_model,
-                    author=GIT_BOT,
-                    committer=GIT_BOT
-                )
+                commit_changes(repo, modified_files, commit_message, model)
                 yield stream.event("info", {"message": "Changes committed"})
 
             # Push changes to remote repository if change_type is 'github'
@@ -401,11 +388,14 @@ PR description should include:
             if change_type == 'github':
                 with stream.stage("create_pr"):
                     pr_description_with_model = f"{pr_description}\n\nModel: {model}"
+                    repo_github = entry['config'].get('github', {})
                     pr_url = create_github_pr(
                         pr_title,
                         branch_name,
                         pr_description_with_model,
-                        base_branch
+                        base_branch,
+                        repo_owner=repo_github.get('repo_owner'),
+                        repo_name=repo_github.get('repo_name')
                     )
                     if pr_url:
                         yield stream.event("complete", {
@@ -435,32 +425,91 @@ PR description should include:
 
         except Exception as e:
             logger.exception("Error processing request")
+            record_error(e)
             if repo and original_branch:
                 cleanup_failed_operation(repo, original_branch, new_branch.name if new_branch else None, change_type)
             yield stream.event("error", {"message": str(e)})
+        finally:
+            # Leave the working tree on the branch the user had checked out, so the
+            # next job does not start from this job's branch
+            try:
+                if repo and original_branch and repo.active_branch != original_branch:
+                    original_branch.checkout()
+            except Exception as e:
+                logger.error(f"Failed to check out '{original_branch}' again: {str(e)}")
+            repo_locks.close()
 
-    return Response(generate(), mimetype='text/event-stream')
+    return event_stream_response(generate())
 
-@app.route('/api/repo/branches')
+@api.route('/api/batch', methods=['POST'])
+def create_batch():
+    """Start a batch of (prompt, files) jobs; poll /api/batch/<id> for progress"""
+    data = request.json
+    jobs = data.get('jobs', [])
+    mode = data.get('mode', 'per_job')
+    base_branch = data.get('base_branch', 'main')
+
+    if not jobs or any(not job.get('prompt') or not job.get('selected_files') for job in jobs):
+        return jsonify({"type": "error", "message": "Each job needs a prompt and selected_files"}), 400
+    if mode not in ('per_job', 'combined'):
+        return jsonify({"type": "error", "message": f"Unknown mode '{mode}'"}), 400
+    max_jobs = get_batch_config()['max_jobs']
+    if len(jobs) > max_jobs:
+        return jsonify({"type": "error", "message": f"At most {max_jobs} jobs per batch"}), 400
+
+    repo_id = request_repo_id()
+    error = unknown_repo_error(repo_id)
+    if error:
+        return error
+
+    change_type = data.get('change_type', 'github' if github_enabled() else 'local')
+    if change_type == 'github' and not github_enabled():
+        change_type = 'local'
+
+    if not try_begin_stream():
+        return jsonify({"type": "error", "message": "Server is busy, retry later"}), 503, {"Retry-After": "5"}
+
+    batch = start_batch(get_repository(repo_id), jobs, select_model(data.get('model')), mode, change_type, base_branch)
+    return jsonify(batch), 202
+
+@api.route('/api/batch')
+def batches():
+    """List batches started on this instance"""
+    return jsonify(list_batches())
+
+@api.route('/api/batch/<batch_id>')
+def batch_status(batch_id):
+    """Get a batch's progress and per-job results"""
+    batch = get_batch(batch_id)
+    if batch is None:
+        return jsonify({"type": "error", "message": f"Unknown batch '{batch_id}'"}), 404
+    return jsonify(batch)
+
+@api.route('/api/repo/branches')
 def repo_branches():
     """Get list of local and remote branches."""
+    repo_id = request_repo_id()
+    error = unknown_repo_error(repo_id)
+    if error:
+        return error
     try:
-        repo = Repo(os.getcwd())
-        current_branch = repo.active_branch.name
-
-        local_branches = [head.name for head in repo.heads]
-        remote_branches = [ref.name for ref in repo.remotes.origin.refs]
-
-        return jsonify({
-            "current_branch": current_branch,
-            "local_branches": local_branches,
-            "remote_branches": remote_branches
-        })
+        with locked_repo(repo_id) as entry:
+            repo = entry['repo']
+
+            def build_branches():
+                return {
+                    "current_branch": repo.active_branch.name,
+                    "local_branches": [head.name for head in repo.heads],
+                    "remote_branches": [ref.name for ref in repo.remotes.origin.refs]
+                }
+
+            etag = make_etag('branches', git_state_token(repo))
+            return cached_json_response(entry['cache'], 'branches', etag, build_branches)
     except Exception as e:
         logger.error(f"Error getting branches: {str(e)}")
         return jsonify({"type": "error", "message": str(e)}), 500
 
-@app.route('/api/repo/switch-branch', methods=['POST'])
+@api.route('/api/repo/switch-branch', methods=['POST'])
 def switch_branch():
     """Switch to a different local branch."""
     data = request.json
@@ -469,17 +518,23 @@ def switch_branch():
     if not branch_name:
         return jsonify({"type": "error", "message": "Missing 'branch' parameter"}), 400
 
+    repo_id = request_repo_id()
+    error = unknown_repo_error(repo_id)
+    if error:
+        return error
+
     try:
-        repo = Repo(os.getcwd())
+        with locked_repo(repo_id) as entry:
+            repo = entry['repo']
 
-        if repo.is_dirty(untracked_files=True):
-            return jsonify({"type": "error", "message": "Cannot switch branches with uncommitted changes"}), 400
+            if repo.is_dirty(untracked_files=True):
+                return jsonify({"type": "error", "message": "Cannot switch branches with uncommitted changes"}), 400
 
-        if branch_name not in [head.name for head in repo.heads]:
-            return jsonify({"type": "error", "message": f"Branch '{branch_name}' does not exist"}), 400
+            if branch_name not in [head.name for head in repo.heads]:
+                return jsonify({"type": "error", "message": f"Branch '{branch_name}' does not exist"}), 400
 
-        repo.git.checkout(branch_name)
-        current_branch = repo.active_branch.name
+            repo.git.checkout(branch_name)
+            current_branch = repo.active_branch.name
 
         return jsonify({"type": "complete", "message": f"Switched to branch {branch_name}", "current_branch": current_branch})
     except Exception as e:
@@ -487,4 +542,7 @@ def switch_branch():
         return jsonify({"type": "error", "message": str(e)}), 500
 
 if __name__ == '__main__':
+    app = create_app()
+    start_background_workers()
+    atexit.register(stop_background_workers)
     app.run(debug=False, host='0.0.0.0', port=int(os.environ.get('PORT', 5500)))
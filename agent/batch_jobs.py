@@ -0,0 +1,370 @@
+"""batch_jobs.py - Apply many (prompt, files) jobs in one run with batched LLM calls"""
+import copy
+import time
+import uuid
+import logging
+import threading
+from queue import Queue, Empty
+
+from llm_integration import batch_chat_completion, chat_completion
+from change_pipeline import (
+    read_files, change_messages, parse_changes_response, metadata_messages,
+    parse_metadata_response, fallback_metadata, apply_changes, commit_changes,
+    cleanup_failed_operation, unique_branch_name
+)
+from file_validation import batch_validate_and_repair
+from chunked_edits import large_files, generate_changes
+from github_integration import create_github_pr
+from repo_registry import locked_repo
+from stream_events import end_stream
+from tracing import span, set_attributes, record_error
+
+logger = logging.getLogger(__name__)
+
+# Batches finished more than this many seconds ago are forgotten
+BATCH_RETENTION = 24 * 60 * 60
+
+# batch id -> batch dict, guarded by _batches_lock
+_batches = {}
+_batches_lock = threading.Lock()
+
+def _update(batch, **fields):
+    with _batches_lock:
+        batch.update(fields)
+
+def _update_job(job, **fields):
+    with _batches_lock:
+        job.update(fields)
+
+def _forget_old_batches():
+    cutoff = time.time() - BATCH_RETENTION
+    with _batches_lock:
+        for batch_id in [b['id'] for b in _batches.values() if b['finished'] and b['finished'] < cutoff]:
+            del _batches[batch_id]
+
+def get_batch(batch_id):
+    """Return a snapshot of a batch's status, or None if unknown"""
+    with _batches_lock:
+        batch = _batches.get(batch_id)
+        return copy.deepcopy(batch) if batch else None
+
+def list_batches():
+    """Return a summary of every known batch, newest first"""
+    with _batches_lock:
+        batches = sorted(_batches.values(), key=lambda b: b['created'], reverse=True)
+        return [
+            {key: batch[key] for key in ('id', 'repo', 'model', 'mode', 'status', 'created', 'finished', 'generated', 'total')}
+            for batch in batches
+        ]
+
+def start_batch(entry, jobs, model, mode, change_type, base_branch):
+    """
+    Start a batch in a background thread and return its initial snapshot.
+
+    The caller must have reserved a job slot with stream_events.try_begin_stream();
+    it is released when the batch finishes.
+
+    Args:
+        entry: Repository registry entry
+        jobs: List of {"prompt", "selected_files", "context_files"} dicts
+        model: Model name used for every job
+        mode: "per_job" for one branch/PR per job, "combined" for a single branch/PR
+        change_type: "local" or "github"
+        base_branch: Base branch for GitHub PRs
+    """
+    _forget_old_batches()
+    batch = {
+        "id": uuid.uuid4().hex[:12],
+        "repo": entry['id'],
+        "model": model,
+        "mode": mode,
+        "change_type": change_type,
+        "base_branch": base_branch,
+        "status": "queued",
+        "created": time.time(),
+        "finished": None,
+        "generated": 0,
+        "total": len(jobs),
+        "llm_stats": {},
+        "error": None,
+        "result": None,
+        "trace_id": None,
+        "jobs": [
+            {
+                "index": i,
+                "prompt": job['prompt'],
+                "selected_files": job['selected_files'],
+                "context_files": job.get('context_files', []),
+                "status": "queued",
+                "error": None,
+                "summary": None,
+                "branch": None,
+                "pr_url": None,
+                "validation": None
+            }
+            for i, job in enumerate(jobs)
+        ]
+    }
+    with _batches_lock:
+        _batches[batch['id']] = batch
+    threading.Thread(target=_run_batch, args=(batch, entry), name=f"batch-{batch['id']}", daemon=True).start()
+    return get_batch(batch['id'])
+
+def _collect_stats(batch, stats_queue):
+    """Add queued LLM usage to the batch's running totals"""
+    while True:
+        try:
+            usage = stats_queue.get_nowait()
+        except Empty:
+            break
+        with _batches_lock:
+            for key, value in usage.items():
+                if isinstance(value, (int, float)):
+                    batch['llm_stats'][key] = batch['llm_stats'].get(key, 0) + value
+
+def _publish(entry, repo, base_commit, metadata, changes, new_files, selected_files, model, change_type, base_branch):
+    """
+    Create a branch from base_commit (where the files were read), commit the changes and push/open a PR.
+
+    Returns:
+        (branch_name, pr_url)
+    """
+    branch_name = unique_branch_name(repo, metadata["branch_name"])
+    original_branch = repo.active_branch
+    new_branch = None
+    try:
+        new_branch = repo.create_head(branch_name, base_commit)
+        new_branch.checkout()
+        modified_files = apply_changes(entry, repo, changes, new_files, selected_files)
+        commit_changes(repo, modified_files, metadata["commit_message"], model)
+
+        if change_type != 'github':
+            return branch_name, f"local://{branch_name}"
+
+        repo.git.push('--set-upstream', 'origin', branch_name)
+        repo_github = entry['config'].get('github', {})
+        pr_url = create_github_pr(
+            metadata["pr_title"],
+            branch_name,
+            f"{metadata['pr_description']}\n\nModel: {model}",
+            base_branch,
+            repo_owner=repo_github.get('repo_owner'),
+            repo_name=repo_github.get('repo_name')
+        )
+        if not pr_url:
+            raise ValueError("Failed to create GitHub PR.")
+        return branch_name, pr_url
+    except Exception:
+        cleanup_failed_operation(repo, original_branch, new_branch.name if new_branch else None, change_type)
+        raise
+    finally:
+        # Every branch starts from the same base, so go back to it after each one
+        if repo.active_branch != original_branch:
+            original_branch.checkout()
+
+def _generate_metadata(prompts, summaries, file_names, model, stats_queue):
+    """Generate branch/PR/commit metadata for each (prompt, summary, files), falling back per item"""
+    results = batch_chat_completion(
+        [metadata_messages(prompt, summary, names) for prompt, summary, names in zip(prompts, summaries, file_names)],
+        model,
+        stats_queue=stats_queue,
+        json_output=True,
+        extract_code_block=True
+    )
+    metadata = []
+    for result, summary in zip(results, summaries):
+        try:
+            if isinstance(result, Exception):
+                raise result
+            metadata.append(parse_metadata_response(result, summary))
+        except Exception as e:
+            logger.error(f"Error generating branch name/description/commit message: {str(e)}. Using fallback.")
+            metadata.append(fallback_metadata(summary))
+    return metadata
+
+def _run_batch(batch, entry):
+    """Generate all jobs' changes in one batched call, validate them, then publish them"""
+    with span("job.batch", batch=batch['id'], repo=entry['id'], model=batch['model'],
+              mode=batch['mode'], jobs=batch['total']) as batch_span:
+        _update(batch, trace_id=batch_span['trace_id'])
+        _run_batch_stages(batch, entry)
+
+def _run_batch_stages(batch, entry):
+    model = batch['model']
+    stats_queue = Queue()
+    try:
+        with span("reading_files"):
+            _update(batch, status="reading_files")
+            read = []
+            # Under the lock so a stream job's checked out branch is never read; every
+            # branch is then created from the commit the files were read at
+            with locked_repo(entry['id']) as locked:
+                base_commit = locked['repo'].head.commit
+                for job in batch['jobs']:
+                    try:
+                        read.append((job, read_files(entry, job['selected_files'] + job['context_files'])))
+                    except Exception as e:
+                        _update_job(job, status="failed", error=f"Failed to read files: {str(e)}")
+            pending = []
+            # Jobs with files too large for one response are edited region by region on their own
+            chunked = []
+            for job, files_content in read:
+                if large_files(files_content, job['selected_files'], model):
+                    chunked.append((job, files_content))
+                else:
+                    pending.append((job, files_content, change_messages(files_content, job['prompt'])))
+
+        with span("generate_changes", requests=len(pending), chunked_jobs=len(chunked)):
+            _update(batch, status="generating")
+            for job in [job for job, _, _ in pending] + [job for job, _ in chunked]:
+                _update_job(job, status="generating")
+
+            def progress(done, total):
+                _update(batch, generated=done)
+                _collect_stats(batch, stats_queue)
+
+            results = batch_chat_completion(
+                [messages for _, _, messages in pending],
+                model,
+                stats_queue=stats_queue,
+                json_output=True,
+                extract_code_block=True,
+                progress=progress
+            )
+
+            generated = []
+            for (job, files_content, _), result in zip(pending, results):
+                try:
+                    if isinstance(result, Exception):
+                        raise result
+                    changes, new_files, summary = parse_changes_response(result)
+                    _update_job(job, status="generated", summary=summary)
+                    generated.append((job, files_content, changes, new_files, summary))
+                except Exception as e:
+                    _update_job(job, status="failed", error=str(e))
+            _update(batch, generated=len(pending))
+
+            for job, files_content in chunked:
+                try:
+                    changes, new_files, summary = generate_changes(
+                        files_content, job['selected_files'], job['prompt'], model, stats_queue=stats_queue
+                    )
+                    _update_job(job, status="generated", summary=summary)
+                    generated.append((job, files_content, changes, new_files, summary))
+                except Exception as e:
+                    _update_job(job, status="failed", error=str(e))
+                _update(batch, generated=batch['generated'] + 1)
+                _collect_stats(batch, stats_queue)
+
+        with span("validate_changes", jobs=len(generated)):
+            _update(batch, status="validating")
+            reports = batch_validate_and_repair(
+                [(files_content, changes, new_files, job['selected_files'], job['prompt'])
+                 for job, files_content, changes, new_files, _ in generated],
+                model,
+                root=entry['path'],
+                stats_queue=stats_queue
+            )
+            valid = []
+            for (job, _, changes, new_files, summary), report in zip(generated, reports):
+                if isinstance(report, Exception):
+                    _update_job(job, status="failed", error=str(report))
+                    continue
+                _update_job(job, validation=report)
+                valid.append((job, changes, new_files, summary))
+            generated = valid
+
+        with span("publish", jobs=len(generated)):
+            _update(batch, status="publishing")
+            if batch['mode'] == 'combined':
+                _publish_combined(batch, entry, base_commit, generated, stats_queue)
+            else:
+                _publish_per_job(batch, entry, base_commit, generated, stats_queue)
+
+        failed = sum(1 for job in batch['jobs'] if job['status'] == 'failed')
+        set_attributes(failed_jobs=failed)
+        _update(batch, status="complete" if failed == 0 else "completed_with_errors")
+    except Exception as e:
+        logger.exception(f"Batch {batch['id']} failed")
+        record_error(e)
+        _update(batch, status="failed", error=str(e))
+    finally:
+        _collect_stats(batch, stats_queue)
+        _update(batch, finished=time.time())
+        end_stream()
+
+def _publish_per_job(batch, entry, base_commit, generated, stats_queue):
+    """One branch (and PR) per successfully generated job"""
+    metadata = _generate_metadata(
+        [job['prompt'] for job, _, _, _ in generated],
+        [summary for _, _, _, summary in generated],
+        [list(changes.keys()) + list(new_files.keys()) for _, changes, new_files, _ in generated],
+        batch['model'],
+        stats_queue
+    )
+    for (job, changes, new_files, _), job_metadata in zip(generated, metadata):
+        # Names are made in the same second and often share a slug (same prompt
+        # on many files), so the batch id and job index keep them apart
+        job_metadata = {**job_metadata, "branch_name": f"{job_metadata['branch_name']}-{batch['id'][:8]}-{job['index']}"}
+        try:
+            with span("publish_job", job=job['index']), locked_repo(entry['id']) as locked:
+                branch_name, pr_url = _publish(
+                    entry, locked['repo'], base_commit, job_metadata, changes, new_files, job['selected_files'],
+                    batch['model'], batch['change_type'], batch['base_branch']
+                )
+            _update_job(job, status="complete", branch=branch_name, pr_url=pr_url)
+        except Exception as e:
+            logger.error(f"Batch {batch['id']} job {job['index']} failed to publish: {str(e)}")
+            _update_job(job, status="failed", error=str(e))
+
+def _publish_combined(batch, entry, base_commit, generated, stats_queue):
+    """Merge all jobs' changes into a single branch (and PR); jobs touching the same file conflict"""
+    changes, new_files, selected_files = {}, {}, []
+    owners = {}
+    included = []
+    for job, job_changes, job_new_files, summary in generated:
+        job_files = set(job_changes) | set(job_new_files)
+        conflicts = sorted(job_files & set(owners))
+        if conflicts:
+            _update_job(job, status="failed", error=f"Conflicts with job {owners[conflicts[0]]} on {', '.join(conflicts)}")
+            continue
+        for path in job_files:
+            owners[path] = job['index']
+        changes.update(job_changes)
+        new_files.update(job_new_files)
+        selected_files.extend(job['selected_files'])
+        included.append((job, summary))
+
+    if not included:
+        return
+
+    prompt = "\n".join(f"{i + 1}. {job['prompt']}" for i, (job, _) in enumerate(included))
+    summary = "\n".join(f"- {summary}" for _, summary in included)
+    try:
+        metadata = parse_metadata_response(
+            chat_completion(
+                metadata_messages(prompt, summary, list(changes.keys()) + list(new_files.keys())),
+                batch['model'],
+                stats_queue=stats_queue,
+                json_output=True,
+                extract_code_block=True
+            ),
+            summary
+        )
+    except Exception as e:
+        logger.error(f"Error generating branch name/description/commit message: {str(e)}. Using fallback.")
+        metadata = fallback_metadata(summary)
+
+    try:
+        with locked_repo(entry['id']) as locked:
+            branch_name, pr_url = _publish(
+                entry, locked['repo'], base_commit, metadata, changes, new_files, selected_files,
+                batch['model'], batch['change_type'], batch['base_branch']
+            )
+    except Exception as e:
+        for job, _ in included:
+            _update_job(job, status="failed", error=str(e))
+        raise
+    _update(batch, result={"branch": branch_name, "pr_url": pr_url, "pr_title": metadata["pr_title"]})
+    for job, _ in included:
+        _update_job(job, status="complete", branch=branch_name, pr_url=pr_url)
@@ -0,0 +1,195 @@
+"""bench_sse.py - Load test concurrent /api/pr/create/stream jobs against serve.py
+
+    python agent/bench_sse.py [concurrent_jobs] [llm_delay_seconds]
+
+Starts a stand-in OpenAI-compatible LLM server that answers after a fixed
+delay, a scratch Git repository, and serve.py pointed at both, then opens
+the given number of streaming jobs at once and reports how many completed
+and how long they took. Requires gevent and the openai package.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import threading
+import subprocess
+import statistics
+import itertools
+import urllib.request
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+FILES_PER_REPO = 8
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_fake_llm(delay):
+    """Serve /v1/chat/completions, answering GitIQ's two prompts after `delay` seconds"""
+    counter = itertools.count()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            system_prompt = body['messages'][0]['content']
+            time.sleep(delay)
+            if '"branch_name"' in system_prompt:
+                content = {
+                    "branch_name": f"load_test_{next(counter)}",
+                    "pr_title": "Load test",
+                    "pr_description": "Load test",
+                    "commit_message": "Load test"
+                }
+            else:
+                user_prompt = body['messages'][1]['content']
+                target = next(f"file_{i}.txt" for i in range(FILES_PER_REPO) if f"file_{i}.txt" in user_prompt)
+                content = {"changes": {target: f"updated {time.time()}\n"}, "summary": "Load test"}
+            usage = {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150}
+            if body.get('stream'):
+                chunks = [
+                    {"choices": [{"delta": {"role": "assistant", "content": json.dumps(content)}, "finish_reason": None}]},
+                    {"choices": [{"delta": {}, "finish_reason": "stop"}]},
+                    {"choices": [], "usage": usage}
+                ]
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.end_headers()
+                for chunk in chunks:
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+                return
+            payload = json.dumps({
+                "choices": [{"message": {"role": "assistant", "content": json.dumps(content)},
+                             "finish_reason": "stop"}],
+                "usage": usage
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(('127.0.0.1', free_port()), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def make_workspace(llm_port, concurrent_jobs):
+    """Create a scratch repo with config.json pointing at the fake LLM"""
+    workspace = tempfile.mkdtemp(prefix='gitiq-bench-')
+    for i in range(FILES_PER_REPO):
+        with open(os.path.join(workspace, f"file_{i}.txt"), 'w') as f:
+            f.write(f"file {i}\n")
+    config = {
+        "git": {"name": "GitIQ Bench", "email": "bench@example.com"},
+        "github": {"enabled": False},
+        "llm_apis": {"fake": {"api_base": f"http://127.0.0.1:{llm_port}/v1", "api_key": "FAKE_API_KEY"}},
+        "models": {"Fake": {"llm_api": "fake", "name": "fake", "cost": [0, 0], "max_output_tokens": 1000}},
+        "default_model": "Fake",
+        "ledger": {"enabled": False},
+        "serving": {"max_streams": concurrent_jobs, "heartbeat_interval": 1}
+    }
+    with open(os.path.join(workspace, 'config.json'), 'w') as f:
+        json.dump(config, f)
+    with open(os.path.join(workspace, '.gitignore'), 'w') as f:
+        f.write("config.json\n")
+    subprocess.run(['git', 'init', '-q', '-b', 'main'], cwd=workspace, check=True)
+    subprocess.run(['git', 'add', '.'], cwd=workspace, check=True)
+    subprocess.run(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@example.com',
+                    'commit', '-qm', 'initial'], cwd=workspace, check=True)
+    return workspace
+
+def run_job(port, index, results):
+    """Open one streaming job and record its outcome, duration and heartbeats"""
+    body = json.dumps({
+        "prompt": "load test",
+        "selected_files": [f"file_{index % FILES_PER_REPO}.txt"],
+        "change_type": "local"
+    }).encode()
+    request = urllib.request.Request(f"http://127.0.0.1:{port}/api/pr/create/stream", data=body,
+                                     headers={'Content-Type': 'application/json'})
+    start = time.time()
+    outcome, heartbeats, error = 'error', 0, None
+    try:
+        with urllib.request.urlopen(request, timeout=600) as response:
+            for raw_line in response:
+                line = raw_line.decode().strip()
+                if line.startswith(': heartbeat'):
+                    heartbeats += 1
+                elif line.startswith('data: '):
+                    event = json.loads(line[6:])
+                    if event['stage'] == 'complete':
+                        outcome = 'complete'
+                    elif event['stage'] == 'error':
+                        error = event.get('message')
+    except urllib.error.HTTPError as e:
+        outcome = f"http_{e.code}"
+    except Exception as e:
+        outcome = type(e).__name__
+    results.append({"outcome": outcome, "seconds": time.time() - start, "heartbeats": heartbeats,
+                    "error": error})
+
+def wait_for_server(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/models", timeout=1)
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError("serve.py did not start")
+
+def main():
+    concurrent_jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 3.0
+
+    llm = start_fake_llm(delay)
+    workspace = make_workspace(llm.server_address[1], concurrent_jobs)
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), FAKE_API_KEY='fake', PYTHONPATH=AGENT_DIR)
+    server = subprocess.Popen([sys.executable, os.path.join(AGENT_DIR, 'serve.py')], cwd=workspace,
+                              env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(port)
+        results = []
+        threads = [threading.Thread(target=run_job, args=(port, i, results)) for i in range(concurrent_jobs)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.time() - start
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+        llm.shutdown()
+
+    completed = [r for r in results if r['outcome'] == 'complete']
+    outcomes = {}
+    for r in results:
+        outcomes[r['outcome']] = outcomes.get(r['outcome'], 0) + 1
+    durations = sorted(r['seconds'] for r in completed)
+    print(f"jobs: {concurrent_jobs}, LLM delay per call: {delay:.1f}s (2 calls per job)")
+    print(f"outcomes: {outcomes}")
+    print(f"wall time: {wall:.1f}s")
+    if durations:
+        p95 = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        print(f"job duration: median {statistics.median(durations):.1f}s, p95 {p95:.1f}s, max {durations[-1]:.1f}s")
+        print(f"heartbeats per job: median {statistics.median(r['heartbeats'] for r in completed)}")
+    errors = sorted({r['error'] for r in results if r['error']})
+    for error in errors[:5]:
+        print(f"error: {error}")
+    print(f"workspace: {workspace}")
+
+if __name__ == '__main__':
+    main()
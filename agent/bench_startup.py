@@ -0,0 +1,51 @@
+"""bench_startup.py - Measure GitIQ worker startup time
+
+Run from the repository root (where config.json lives):
+
+    python agent/bench_startup.py [runs]
+
+Each run starts a fresh interpreter, imports app.py and calls create_app(),
+so the numbers reflect what a newly spawned worker pays before it can serve.
+"""
+import os
+import sys
+import json
+import subprocess
+import statistics
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Executed in a fresh interpreter per run; prints timings as JSON
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.create_app()
+t2 = time.perf_counter()
+heavy = [m for m in ('openai', 'anthropic', 'tiktoken', 'github') if m in sys.modules]
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "create_app_ms": (t2 - t1) * 1000,
+                  "eager_modules": heavy}))
+"""
+
+def run_once():
+    """Start one interpreter and return its timing dict"""
+    env = dict(os.environ, PYTHONPATH=AGENT_DIR)
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    results = [run_once() for _ in range(runs)]
+    for key in ("import_ms", "create_app_ms"):
+        values = [r[key] for r in results]
+        print(f"{key:>14}: median {statistics.median(values):7.1f} ms  "
+              f"min {min(values):7.1f} ms  max {max(values):7.1f} ms")
+    eager = sorted({m for r in results for m in r["eager_modules"]})
+    print(f"provider modules loaded at startup: {', '.join(eager) if eager else 'none'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""change_pipeline.py - Shared steps for turning a prompt into a committed branch"""
+import re
+import json
+import time
+import logging
+
+from git import Actor
+
+from config import get_config
+from repo_registry import resolve_repo_path
+
+logger = logging.getLogger(__name__)
+
+CHANGES_SYSTEM_PROMPT = """Generate changes for the specified files based on the prompt. You need to return the ENTIRE updated file(s). Follow the style guide and don't make another other changes, removing comments, etc.
+* Do NOT add comments like \" # Rest of the functions remain the same ... \"
+* Do NOT remove unrelated comments in the code
+Return ONLY a JSON object with the following structure, no additional next or content before or after the JSON as follows, making sure the output is VALID JSON escaping newlines as \\n, etc:
+{
+  \"changes\": {
+    \"file_path.txt\": \"new_content based on 'Requested changes' user prompt\",
+    ...
+  },
+  \"new_files\": {
+    \"new_file_path.txt\": \"content of the new file\",
+    ...
+  },
+  \"summary\": \"detailed description of changes made\"
+}"""
+
+REGION_SYSTEM_PROMPT = """You are editing one region of a large file that is too long to rewrite at once. Apply the requested changes to the region only; the lines before and after it are shown for context and are edited separately.
+* Do NOT add comments like \" # Rest of the functions remain the same ... \"
+* Do NOT remove unrelated comments in the code
+* Do NOT include the context lines in the region's content
+Return ONLY a JSON object with the following structure, no additional text or content before or after the JSON as follows, making sure the output is VALID JSON escaping newlines as \\n, etc:
+{
+  \"changed\": true if the region needs changes, else false,
+  \"content\": \"the ENTIRE updated region if changed, else an empty string\",
+  \"summary\": \"short description of the changes made to the region, or an empty string\"
+}"""
+
+METADATA_SYSTEM_PROMPT = """Return ONLY a JSON object with the following structure, no additional text or content before or after the JSON as follows, making sure the output is VALID JSON escaping newlines as \\n, etc:
+{
+  \"branch_name\": \"feature-name\",
+  \"pr_title\": \"Descriptive PR title\",
+  \"pr_description\": \"Full PR description in markdown\",
+  \"commit_message\": \"Commit message following best practices, first line summary (<72 chars), then blank line, then details\"
+}
+Branch name must:
+- Use only lowercase letters, numbers, hyphens, and underscores
+- Be descriptive of the changes made
+- Maximum 50 characters
+- Use snake_case for multiple words (e.g., update_auth_system)
+
+PR title should:
+- Be descriptive and concise
+- Use spaces and capitalization as appropriate
+- Not have the same restrictions as branch names
+- Should not exceed 72 characters
+
+Commit message should:
+- Be in present tense
+- First line summary less than 72 characters
+- Second line should be blank
+- Following lines can include detailed description
+- The commit message should be formatted as per the following example:
+
+[First line summary]
+
+Prompt: [Original prompt]
+
+Description: [Detailed description]
+
+PR description should include:
+
+## Prompt
+[Original prompt]
+
+## Summary of Changes
+[Summary of changes]
+
+### Technical Details
+[Technical details of the changes]
+
+### Files Modified
+- [File 1]
+- [File 2]
+"""
+
+def get_git_bot():
+    """Return the commit author/committer configured in config.json"""
+    git_config = get_config().get('git', {})
+    return Actor(
+        git_config.get('name', 'GitIQ-bot'),
+        git_config.get('email', 'gitiq-bot@github.com')
+    )
+
+def read_files(entry, file_paths):
+    """Read repository files into {path: content}"""
+    files_content = {}
+    for file_path in file_paths:
+        with open(resolve_repo_path(entry, file_path), 'r') as f:
+            files_content[file_path] = f.read()
+    return files_content
+
+def change_messages(files_content, prompt):
+    """Build the chat messages asking the LLM for changed file contents"""
+    return [
+        {"role": "system", "content": CHANGES_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"Files to modify:\n{json.dumps(files_content, indent=2)}\n\nRequested changes:\n{prompt}"
+        }
+    ]
+
+def region_messages(file_path, before, region, after, first_line, prompt, other_files, context_files=None):
+    """Build the chat messages asking the LLM to edit one region of a large file"""
+    last_line = first_line + len(region.splitlines()) - 1
+    other = f"Other files in this change: {', '.join(other_files)}\n\n" if other_files else ""
+    if context_files:
+        other += f"Context files (read-only):\n{json.dumps(context_files, indent=2)}\n\n"
+    return [
+        {"role": "system", "content": REGION_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": (
+                f"File: {file_path}\n\n{other}"
+                f"Context before the region:\n{before}\n"
+                f"Region to edit (lines {first_line}-{last_line}):\n{region}\n"
+                f"Context after the region:\n{after}\n"
+                f"Requested changes:\n{prompt}"
+            )
+        }
+    ]
+
+def repair_messages(broken_files, errors, prompt):
+    """Build the chat messages asking the LLM to fix generated files that failed validation"""
+    error_report = "\n\n".join(f"{path}:\n{error}" for path, error in errors.items())
+    return [
+        {"role": "system", "content": CHANGES_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": (
+                f"Files to modify:\n{json.dumps(broken_files, indent=2)}\n\n"
+                f"Requested changes:\nThese files were generated for the request below but fail validation. "
+                f"Fix the errors without changing anything else and return the ENTIRE corrected files in \"changes\".\n\n"
+                f"Original request:\n{prompt}\n\nValidation errors:\n{error_report}"
+            )
+        }
+    ]
+
+def parse_changes_response(changes_response):
+    """
+    Validate the LLM's changes response.
+
+    Returns:
+        (changes, new_files, summary)
+
+    Raises:
+        ValueError: If the response is not a dict with a "changes" key
+    """
+    if not isinstance(changes_response, dict) or "changes" not in changes_response:
+        error_message = changes_response if isinstance(changes_response, str) else "Invalid response format from LLM"
+        logger.error(f"Bad changes response: {error_message}")
+        raise ValueError(error_message)
+    return (
+        changes_response["changes"],
+        changes_response.get("new_files", {}),
+        changes_response.get("summary", "No summary provided")
+    )
+
+def metadata_messages(prompt, summary, file_names):
+    """Build the chat messages asking for branch name, PR title/description and commit message"""
+    return [
+        {"role": "system", "content": METADATA_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"Prompt: {prompt}\n\nChanges summary: {summary}\n\nFiles modified:\n{file_names}"
+        }
+    ]
+
+def parse_metadata_response(branch_description_commit, summary):
+    """
+    Turn the LLM's metadata response into branch name, PR title/description and commit message.
+
+    Returns a dict with "branch_name", "generated_branch_name", "pr_title",
+    "pr_description", "commit_message" and "branch_name_error" (a message if
+    the generated branch name was invalid and dropped, else None).
+
+    Raises:
+        ValueError: If the response is not a dict
+    """
+    if not isinstance(branch_description_commit, dict):
+        logger.error(f"Bad branch/description/commit response: {str(branch_description_commit)}")
+        raise ValueError("Invalid response format from LLM")
+
+    branch_name_error = None
+    generated_branch_name = branch_description_commit.get("branch_name", "").strip()
+    # Validate the generated branch name
+    if not is_valid_branch_name(generated_branch_name):
+        branch_name_error = f"Invalid branch name generated: {generated_branch_name}. Using fallback."
+        logger.error(branch_name_error)
+        generated_branch_name = ""
+
+    # Build the final branch name
+    branch_name = f"GitIQ{('-' + generated_branch_name) if generated_branch_name else ''}-{int(time.time())}"
+
+    pr_title = branch_description_commit.get("pr_title", f"GitIQ: {generated_branch_name if generated_branch_name else branch_name}")
+
+    pr_description = branch_description_commit.get("pr_description", summary)
+    commit_message = branch_description_commit.get("commit_message", pr_description.split('\n')[0])
+    return {
+        "branch_name": branch_name,
+        "generated_branch_name": generated_branch_name,
+        "pr_title": pr_title,
+        "pr_description": pr_description,
+        "commit_message": commit_message,
+        "branch_name_error": branch_name_error
+    }
+
+def fallback_metadata(summary):
+    """Metadata used when the LLM could not generate it"""
+    branch_name = generate_branch_name()
+    return {
+        "branch_name": branch_name,
+        "generated_branch_name": "",
+        "pr_title": f"GitIQ: {branch_name}",
+        "pr_description": f"## Changes\n{summary}",
+        "commit_message": summary,
+        "branch_name_error": None
+    }
+
+def apply_changes(entry, repo, changes, new_files, selected_files):
+    """Write changed selected files and new files to the working tree; returns the paths written"""
+    modified_files = []
+    for file_path, content in changes.items():
+        if file_path in selected_files:  # Only modify selected files
+            logger.info(f"modified file: {file_path}")
+            with open(resolve_repo_path(entry, file_path), 'w') as f:
+                f.write(content)
+            modified_files.append(file_path)
+
+    # Create new files
+    for file_path, content in new_files.items():
+        logger.info(f"created new file: {file_path}")
+        with open(resolve_repo_path(entry, file_path), 'w') as f:
+            f.write(content)
+        modified_files.append(file_path)
+        stage_files(repo, [file_path])  # Add new file to git
+    return modified_files
+
+def stage_files(repo, file_paths):
+    """
+    Stage repository-relative paths with `git add`.
+
+    GitPython's index.add chdirs the whole process into the working tree,
+    which races with commits in other repositories (or worktrees) made at the
+    same time; git runs in the repository's directory without that.
+    """
+    if file_paths:
+        repo.git.add('--', *file_paths)
+
+def commit_changes(repo, modified_files, commit_message, model):
+    """Commit the modified files as the GitIQ bot"""
+    commit_message_with_model = f"{commit_message}\n\nModel: {model}"
+    git_bot = get_git_bot()
+    stage_files(repo, modified_files)
+    repo.index.commit(
+        commit_message_with_model,
+        author=git_bot,
+        committer=git_bot
+    )
+
+def unique_branch_name(repo, branch_name):
+    """Return branch_name, or branch_name-2, -3, ... if a local branch of that name exists"""
+    candidate = branch_name
+    suffix = 2
+    while candidate in repo.heads:
+        candidate = f"{branch_name}-{suffix}"
+        suffix += 1
+    return candidate
+
+def generate_branch_name():
+    """Generate default branch name with timestamp"""
+    return f"GitIQ-{int(time.time())}"
+
+def is_valid_branch_name(name):
+    """Validate branch name according to Git naming conventions"""
+    branch_name_pattern = re.compile(r'^(?!/)(?!.*//)(?!.*/$)[\w\-.\/]+$')
+    return bool(branch_name_pattern.match(name)) and len(name) <= 50
+
+def cleanup_failed_operation(repo, original_branch, new_branch_name, change_type):
+    """Clean up after failed operation"""
+    try:
+        if original_branch:
+            original_branch.checkout()
+        # Only delete local branch if change_type is 'local'
+        if new_branch_name and new_branch_name in repo.heads:
+            if change_type == 'local':
+                repo.delete_head(new_branch_name, force=True)
+        # Attempt to delete remote branch if change_type is 'github'
+        if change_type == 'github':
+            try:
+                repo.git.push('origin', '--delete', new_branch_name)
+                logger.info(f"Deleted remote branch '{new_branch_name}' from remote 'origin'")
+            except Exception as e:
+                logger.warning(f"Failed to delete remote branch '{new_branch_name}': {str(e)}")
+    except Exception as e:
+        logger.error(f"Failed to cleanup: {str(e)}")
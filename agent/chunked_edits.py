@@ -0,0 +1,182 @@
+"""chunked_edits.py - Edit files too large to rewrite in one response region by region"""
+import logging
+
+from config import get_config
+from llm_integration import chat_completion, batch_chat_completion
+from change_pipeline import change_messages, region_messages, parse_changes_response
+from file_scanner import get_scan_config
+from tracing import child_span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNKING_CONFIG = {
+    "enabled": True,
+    # Selected files estimated above this many tokens are edited region by
+    # region; None uses the model's max_output_tokens
+    "file_tokens": None,
+    # Lines per region; a region ends early at a blank line near its end
+    "region_lines": 300,
+    # Lines before and after a region sent along as read-only context
+    "context_lines": 40,
+    # Estimated tokens of the job's context files sent with each region request
+    "context_file_tokens": 4000
+}
+
+def get_chunking_config() -> dict:
+    """Return chunked editing settings from the "chunking" section of config.json."""
+    return {**DEFAULT_CHUNKING_CONFIG, **get_config().get('chunking', {})}
+
+def large_files(files_content: dict, selected_files: list, model: str) -> list:
+    """Return the selected files that are too large to be rewritten in one response"""
+    chunking_config = get_chunking_config()
+    if not chunking_config['enabled']:
+        return []
+    threshold = chunking_config['file_tokens']
+    if threshold is None:
+        threshold = get_config()['models'].get(model, {}).get('max_output_tokens', 4000)
+    bytes_per_token = get_scan_config()['bytes_per_token']
+    return [
+        path for path in selected_files
+        if path in files_content and len(files_content[path].encode('utf-8')) / bytes_per_token > threshold
+    ]
+
+def region_bounds(lines: list, region_lines: int) -> list:
+    """
+    Split a file's lines into regions.
+
+    Returns:
+        [(start, end)] line indexes; a region ends after a blank line in its
+        last quarter if there is one, so edits rarely straddle two regions
+    """
+    bounds = []
+    start = 0
+    while start < len(lines):
+        end = min(start + region_lines, len(lines))
+        if end < len(lines):
+            for i in range(end, start + region_lines * 3 // 4, -1):
+                if not lines[i - 1].strip():
+                    end = i
+                    break
+        bounds.append((start, end))
+        start = end
+    return bounds
+
+def context_excerpt(files_content: dict, selected_files: list, max_tokens: int) -> dict:
+    """Return the context (non-selected) files, cut to about max_tokens in total"""
+    remaining = max_tokens * get_scan_config()['bytes_per_token']
+    excerpt = {}
+    for path, content in files_content.items():
+        if path in selected_files:
+            continue
+        if remaining <= 0:
+            logger.warning(f"Context file {path} left out of region requests, context_file_tokens reached")
+            continue
+        encoded = content.encode('utf-8')
+        if len(encoded) > remaining:
+            logger.warning(f"Context file {path} cut to {int(remaining)} bytes for region requests")
+            content = encoded[:int(remaining)].decode('utf-8', errors='ignore')
+        excerpt[path] = content
+        remaining -= len(encoded)
+    return excerpt
+
+def _apply_region(path, lines, start, end, result):
+    """Return the region's new text and summary from the LLM's region response"""
+    if isinstance(result, Exception):
+        raise ValueError(f"Failed to edit lines {start + 1}-{end} of {path}: {str(result)}")
+    if not isinstance(result, dict) or "changed" not in result:
+        logger.error(f"Bad region response for {path} lines {start + 1}-{end}: {str(result)}")
+        raise ValueError("Invalid response format from LLM")
+    region = "".join(lines[start:end])
+    if not result["changed"]:
+        return region, ""
+    content = result.get("content", "")
+    # The next region starts on a new line
+    if region.endswith("\n") and content and not content.endswith("\n"):
+        content += "\n"
+    return content, result.get("summary", "")
+
+def generate_changes(files_content, selected_files, prompt, model, stats_queue=None):
+    """
+    Ask the LLM for the changed files, editing very large files region by region.
+
+    Files small enough to rewrite in one response are sent in a single request
+    as usual. Each selected file above the chunking threshold is split into
+    regions that are sent as separate requests, concurrently, together with
+    some context lines around them and the (size-bounded) context files; regions the LLM leaves unchanged cost
+    almost no output tokens.
+
+    Returns:
+        (changes, new_files, summary)
+
+    Raises:
+        ValueError: If a response is invalid or a region request failed
+    """
+    large = large_files(files_content, selected_files, model)
+    if not large:
+        return parse_changes_response(chat_completion(
+            change_messages(files_content, prompt),
+            model,
+            stats_queue=stats_queue,
+            json_output=True,
+            extract_code_block=True
+        ))
+
+    chunking_config = get_chunking_config()
+    context_lines = chunking_config['context_lines']
+    requests_messages = []
+    rest = {path: content for path, content in files_content.items() if path not in large}
+    whole_file_request = any(path in rest for path in selected_files)
+    if whole_file_request:
+        note = (f"\n\nThe files {', '.join(large)} are also part of this change but are too large to include; "
+                f"they are edited separately. Do not return them.")
+        requests_messages.append(change_messages(rest, prompt + note))
+
+    # Every region request gets the context files, so they are bounded
+    context_files = context_excerpt(files_content, selected_files, chunking_config['context_file_tokens'])
+    regions = []
+    for path in large:
+        lines = files_content[path].splitlines(keepends=True)
+        other_files = [other for other in selected_files if other != path]
+        for start, end in region_bounds(lines, chunking_config['region_lines']):
+            regions.append((path, lines, start, end))
+            requests_messages.append(region_messages(
+                path,
+                "".join(lines[max(0, start - context_lines):start]),
+                "".join(lines[start:end]),
+                "".join(lines[end:end + context_lines]),
+                start + 1,
+                prompt,
+                other_files,
+                context_files
+            ))
+
+    logger.info(f"Editing {len(large)} large files in {len(regions)} regions")
+    with child_span("chunked_changes", large_files=len(large), regions=len(regions)):
+        results = batch_chat_completion(
+            requests_messages,
+            model,
+            stats_queue=stats_queue,
+            json_output=True,
+            extract_code_block=True,
+            provider_batch=False
+        )
+
+    changes, new_files, summaries = {}, {}, []
+    if whole_file_request:
+        if isinstance(results[0], Exception):
+            raise results[0]
+        changes, new_files, summary = parse_changes_response(results[0])
+        summaries.append(summary)
+        results = results[1:]
+
+    parts = {path: [] for path in large}
+    region_summaries = {path: [] for path in large}
+    for (path, lines, start, end), result in zip(regions, results):
+        content, summary = _apply_region(path, lines, start, end, result)
+        parts[path].append(content)
+        if summary:
+            region_summaries[path].append(summary)
+    for path in large:
+        changes[path] = "".join(parts[path])
+        summaries.append(f"{path}: {' '.join(region_summaries[path]) or 'No changes'}")
+    return changes, new_files, "\n".join(summaries)
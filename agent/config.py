@@ -0,0 +1,91 @@
+"""config.py - Shared config.json loading with reload on change"""
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_config_path = os.path.abspath('config.json')
+_config = None
+_config_mtime = None
+_reload_callbacks = []
+_lock = threading.Lock()
+
+def set_config_path(config_path: str) -> None:
+    """Point the shared config at a different file; it is read on next access."""
+    global _config_path, _config, _config_mtime
+    # Absolute, since GitPython may chdir into a repository during index operations
+    config_path = os.path.abspath(config_path)
+    with _lock:
+        if config_path != _config_path:
+            _config_path = config_path
+            _config = None
+            _config_mtime = None
+
+def on_config_reload(callback) -> None:
+    """Register a callback invoked with the new config dict after each (re)load."""
+    _reload_callbacks.append(callback)
+    if _config is not None:
+        callback(_config)
+
+def get_config() -> dict:
+    """
+    Return the parsed config.json, re-reading it when the file's mtime changes.
+
+    A stat() per call is cheap enough to do on every request, so edits to
+    config.json (new models, keys, GitHub settings) apply without a restart.
+    If a reload fails (e.g. the file is mid-write), the previous config is kept.
+    """
+    global _config, _config_mtime
+    try:
+        mtime = os.stat(_config_path).st_mtime_ns
+    except OSError:
+        if _config is None:
+            raise
+        return _config
+
+    if _config is not None and mtime == _config_mtime:
+        return _config
+
+    with _lock:
+        if _config is not None and mtime == _config_mtime:
+            return _config
+        try:
+            with open(_config_path) as f:
+                new_config = json.load(f)
+        except (OSError, ValueError) as e:
+            if _config is None:
+                raise
+            logger.error(f"Failed to reload {_config_path}, keeping previous config: {str(e)}")
+            return _config
+        if _config is not None:
+            logger.info(f"Reloaded configuration from {_config_path}")
+        _config = new_config
+        _config_mtime = mtime
+
+    for callback in _reload_callbacks:
+        try:
+            callback(new_config)
+        except Exception as e:
+            logger.error(f"Error applying reloaded configuration: {str(e)}")
+    return new_config
+
+def config_version() -> int:
+    """Return a token that changes whenever config.json is reloaded (its mtime)."""
+    get_config()
+    return _config_mtime
+
+def state_path(path: str) -> str:
+    """
+    Resolve a data file path (ledger, traces) and create its directory.
+
+    Relative paths are placed under $XDG_STATE_HOME/gitiq, or ~/.gitiq if it
+    is not set, rather than next to config.json: that is usually the root of
+    the served repository, where the files would show up as untracked changes.
+    """
+    state_home = os.getenv('XDG_STATE_HOME')
+    base = os.path.join(state_home, 'gitiq') if state_home else os.path.join(os.path.expanduser('~'), '.gitiq')
+    path = os.path.join(base, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
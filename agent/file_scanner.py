@@ -0,0 +1,124 @@
+"""file_scanner.py - Size-aware binary detection, line and token counting for repo files"""
+import os
+import mmap
+import codecs
+import logging
+import tempfile
+
+from git.exc import GitCommandError
+
+from config import get_config
+from llm_integration import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Same heuristic as git: a NUL byte in the first 8000 bytes means binary
+SNIFF_SIZE = 8000
+# Count lines in chunks so memory stays flat for large files
+LINE_COUNT_CHUNK = 1 << 20
+
+DEFAULT_SCAN_CONFIG = {
+    # Files larger than this are memory-mapped for line counting
+    "mmap_threshold_bytes": 1 << 20,
+    # Files larger than this are not tokenized; tokens are estimated from size
+    "max_tokenize_bytes": 1 << 20,
+    # Rough bytes-per-token ratio used for estimates
+    "bytes_per_token": 4
+}
+
+def get_scan_config() -> dict:
+    """Return file scanning settings from the "file_scanning" section of config.json."""
+    return {**DEFAULT_SCAN_CONFIG, **get_config().get('file_scanning', {})}
+
+def git_binary_paths(repo, file_paths) -> set:
+    """
+    Return the paths git treats as binary through .gitattributes.
+
+    A path is binary if it has the "binary" macro or "-diff"; "-text" only
+    turns off line ending normalisation, so it does not count. Skips
+    the git call entirely when the repository has no attributes files, and
+    returns an empty set (content sniffing still applies) if it fails.
+    """
+    info_attributes = os.path.join(getattr(repo, 'common_dir', repo.git_dir), 'info', 'attributes')
+    has_attributes = os.path.exists(info_attributes) or any(
+        os.path.basename(path) == '.gitattributes' for path in file_paths
+    )
+    if not has_attributes:
+        return set()
+
+    # Paths go through stdin so one git process handles any number of them
+    with tempfile.TemporaryFile() as paths_file:
+        paths_file.write(('\0'.join(sorted(file_paths)) + '\0').encode('utf-8', 'surrogateescape'))
+        paths_file.seek(0)
+        try:
+            output = repo.git.check_attr('--stdin', '-z', 'binary', 'diff', istream=paths_file)
+        except GitCommandError as e:
+            logger.error(f"git check-attr failed, using content detection only: {str(e)}")
+            return set()
+    binary_paths = set()
+    fields = output.split('\0')
+    for i in range(0, len(fields) - 2, 3):
+        path, attribute, value = fields[i], fields[i + 1], fields[i + 2]
+        if (attribute == 'binary' and value == 'set') or (attribute == 'diff' and value == 'unset'):
+            binary_paths.add(path)
+    return binary_paths
+
+def _count_lines_mmap(full_path: str, size: int) -> int:
+    """Count lines in a large file through mmap, one chunk at a time."""
+    lines = 0
+    with open(full_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for start in range(0, size, LINE_COUNT_CHUNK):
+                lines += mapped[start:start + LINE_COUNT_CHUNK].count(b'\n')
+            if mapped[size - 1:size] != b'\n':
+                lines += 1
+    return lines
+
+def scan_file(full_path: str, size: int, is_binary_attr: bool = False, scan_config: dict = None) -> dict:
+    """
+    Return {"is_binary", "lines", "tokens", "tokens_estimated"} for one file.
+
+    Only the first block is read to detect binary content. Small text files
+    are read whole and tokenized; files above "mmap_threshold_bytes" are
+    memory-mapped to count lines, and files above "max_tokenize_bytes" get a
+    size-based token estimate instead of being tokenized.
+    """
+    scan_config = scan_config or get_scan_config()
+    result = {"is_binary": False, "lines": 0, "tokens": 0, "tokens_estimated": False}
+    if is_binary_attr:
+        result["is_binary"] = True
+        return result
+    if size == 0:
+        return result
+
+    with open(full_path, 'rb') as f:
+        head = f.read(SNIFF_SIZE)
+        if b'\0' in head:
+            result["is_binary"] = True
+            return result
+        if size <= scan_config['max_tokenize_bytes'] and size <= scan_config['mmap_threshold_bytes']:
+            data = head + f.read()
+            try:
+                content = data.decode('utf-8')
+            except UnicodeDecodeError:
+                result["is_binary"] = True
+                return result
+            result["lines"] = len(content.splitlines())
+            result["tokens"] = count_tokens(content)
+            return result
+
+    # Large file: validate the first block only (a multi-byte character may be cut off)
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        result["is_binary"] = True
+        return result
+
+    result["lines"] = _count_lines_mmap(full_path, size)
+    if size <= scan_config['max_tokenize_bytes']:
+        with open(full_path, 'r', encoding='utf-8', errors='replace') as f:
+            result["tokens"] = count_tokens(f.read())
+    else:
+        result["tokens"] = size // scan_config['bytes_per_token']
+        result["tokens_estimated"] = True
+    return result
@@ -0,0 +1,284 @@
+"""file_validation.py - Fast local checks of generated files, with LLM repair of broken ones"""
+import os
+import json
+import shutil
+import logging
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+from config import get_config
+from llm_integration import chat_completion, batch_chat_completion
+from change_pipeline import repair_messages, parse_changes_response
+from tracing import child_span
+
+logger = logging.getLogger(__name__)
+
+# Validator output included in errors (and repair prompts) is cut to this length
+MAX_ERROR_CHARS = 2000
+
+DEFAULT_VALIDATION_CONFIG = {
+    "enabled": True,
+    # Files checked in parallel
+    "max_workers": 8,
+    # Seconds before an external checker or linter is killed
+    "timeout": 30,
+    # Repair requests sent for files that still fail
+    "repair_attempts": 1,
+    # "fail" stops the job if files are still broken after repair, "commit" commits them anyway
+    "on_failure": "fail",
+    # Extension -> command run on a copy of the file, "{path}" is replaced by its path
+    "linters": {}
+}
+
+# yaml and tomllib are optional; without them those files are not checked
+try:
+    import yaml
+except ImportError:
+    yaml = None
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+def get_validation_config() -> dict:
+    """Return validation settings from the "validation" section of config.json."""
+    return {**DEFAULT_VALIDATION_CONFIG, **get_config().get('validation', {})}
+
+def _truncate(text: str) -> str:
+    text = text.strip()
+    return text if len(text) <= MAX_ERROR_CHARS else text[:MAX_ERROR_CHARS] + "\n..."
+
+def _check_python(file_path, content):
+    compile(content, file_path, 'exec', dont_inherit=True)
+
+def _check_json(file_path, content):
+    json.loads(content)
+
+def _check_yaml(file_path, content):
+    if yaml is not None:
+        list(yaml.safe_load_all(content))
+
+def _check_toml(file_path, content):
+    if tomllib is not None:
+        tomllib.loads(content)
+
+def _check_xml(file_path, content):
+    ElementTree.fromstring(content.encode('utf-8'))
+
+# Extension -> in-process parser; raising means the file is invalid
+IN_PROCESS_CHECKS = {
+    ".py": _check_python,
+    ".json": _check_json,
+    ".yaml": _check_yaml,
+    ".yml": _check_yaml,
+    ".toml": _check_toml,
+    ".xml": _check_xml,
+    ".svg": _check_xml
+}
+
+# Extension -> syntax-only command, skipped if the tool is not installed
+COMMAND_CHECKS = {
+    ".js": ["node", "--check", "{path}"],
+    ".mjs": ["node", "--check", "{path}"],
+    ".cjs": ["node", "--check", "{path}"],
+    ".sh": ["bash", "-n", "{path}"]
+}
+
+def _run_command(command, file_path, content, root, timeout):
+    """Run command on a temporary copy of the file; returns the error output or None"""
+    if shutil.which(command[0]) is None:
+        logger.debug(f"{command[0]} not installed, not checking {file_path}")
+        return None
+    with tempfile.TemporaryDirectory(prefix="gitiq-validate-") as temp_dir:
+        temp_path = os.path.join(temp_dir, os.path.basename(file_path))
+        with open(temp_path, 'w') as f:
+            f.write(content)
+        try:
+            result = subprocess.run(
+                [part.replace("{path}", temp_path) for part in command],
+                cwd=root or temp_dir,
+                capture_output=True,
+                text=True,
+                timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            return f"{command[0]} timed out after {timeout}s"
+    if result.returncode != 0:
+        return _truncate((result.stdout + result.stderr).replace(temp_path, file_path))
+    return None
+
+def validate_file(file_path: str, content: str, root: str = None, validation_config: dict = None):
+    """
+    Check one file's content; returns an error message, or None if it is valid.
+
+    Files with no checker for their extension are always valid.
+    """
+    validation_config = validation_config or get_validation_config()
+    extension = os.path.splitext(file_path)[1].lower()
+    check = IN_PROCESS_CHECKS.get(extension)
+    if check is not None:
+        try:
+            check(file_path, content)
+        except Exception as e:
+            return _truncate(f"{type(e).__name__}: {str(e)}")
+
+    commands = [COMMAND_CHECKS[extension]] if extension in COMMAND_CHECKS else []
+    if extension in validation_config['linters']:
+        commands.append(validation_config['linters'][extension])
+    for command in commands:
+        error = _run_command(command, file_path, content, root, validation_config['timeout'])
+        if error:
+            return error
+    return None
+
+def validate_files(files: dict, root: str = None, validation_config: dict = None) -> dict:
+    """
+    Check {path: content} concurrently.
+
+    Args:
+        files: File contents keyed by repository path
+        root: Working directory for linters, so they find the repository's settings
+
+    Returns:
+        {path: error message} for the files that failed
+    """
+    validation_config = validation_config or get_validation_config()
+    if not files:
+        return {}
+    with child_span("validate_files", files=len(files)), \
+            ThreadPoolExecutor(max_workers=min(validation_config['max_workers'], len(files))) as executor:
+        futures = {
+            file_path: executor.submit(validate_file, file_path, content, root, validation_config)
+            for file_path, content in files.items()
+        }
+        errors = {file_path: future.result() for file_path, future in futures.items()}
+    return {file_path: error for file_path, error in errors.items() if error}
+
+def _generated_files(changes, new_files, selected_files):
+    """The files that apply_changes would write"""
+    files = {path: content for path, content in changes.items() if path in selected_files}
+    files.update(new_files)
+    return files
+
+def _new_errors(files, files_content, root, validation_config):
+    """
+    Validate files, ignoring failures in files that were already invalid before the change.
+
+    Returns:
+        {path: error message}
+    """
+    errors = validate_files(files, root, validation_config)
+    already_broken = validate_files(
+        {path: files_content[path] for path in errors if path in files_content}, root, validation_config
+    )
+    return {path: error for path, error in errors.items() if path not in already_broken}
+
+def _merge_repair(changes, new_files, errors, repair_response):
+    """Replace broken files with the repaired versions from the LLM response"""
+    repaired, repaired_new, _ = parse_changes_response(repair_response)
+    for path, content in {**repaired, **repaired_new}.items():
+        if path not in errors:
+            continue
+        if path in new_files:
+            new_files[path] = content
+        else:
+            changes[path] = content
+
+def _report(checked, repaired, errors, validation_config):
+    if errors and validation_config['on_failure'] == 'fail':
+        raise ValueError("Generated files failed validation:\n" + "\n".join(
+            f"{path}: {error}" for path, error in errors.items()
+        ))
+    return {"checked": checked, "repaired": repaired, "errors": errors}
+
+def validate_and_repair(files_content, changes, new_files, selected_files, prompt, model,
+                        root=None, stats_queue=None):
+    """
+    Validate generated files and ask the LLM to fix just the broken ones.
+
+    changes and new_files are updated in place with the repaired content.
+
+    Returns:
+        {"checked": number of files checked, "repaired": [paths fixed by repair],
+         "errors": {path: error} still failing}
+
+    Raises:
+        ValueError: If files still fail after repair and on_failure is "fail"
+    """
+    validation_config = get_validation_config()
+    files = _generated_files(changes, new_files, selected_files)
+    if not validation_config['enabled'] or not files:
+        return {"checked": 0, "repaired": [], "errors": {}}
+
+    errors = _new_errors(files, files_content, root, validation_config)
+    broken = set(errors)
+    for attempt in range(validation_config['repair_attempts']):
+        if not errors:
+            break
+        logger.info(f"Repairing {len(errors)} files that failed validation (attempt {attempt + 1})")
+        try:
+            _merge_repair(changes, new_files, errors, chat_completion(
+                repair_messages({path: files[path] for path in errors}, errors, prompt),
+                model,
+                stats_queue=stats_queue,
+                json_output=True,
+                extract_code_block=True
+            ))
+        except Exception as e:
+            logger.error(f"Repair request failed: {str(e)}")
+            break
+        files = _generated_files(changes, new_files, selected_files)
+        errors = _new_errors({path: files[path] for path in errors}, files_content, root, validation_config)
+    return _report(len(files), sorted(broken - set(errors)), errors, validation_config)
+
+def batch_validate_and_repair(jobs, model, root=None, stats_queue=None):
+    """
+    validate_and_repair for many jobs, sending each round of repairs as one batch.
+
+    Args:
+        jobs: List of (files_content, changes, new_files, selected_files, prompt) tuples;
+            changes and new_files are updated in place
+
+    Returns:
+        A report dict (as validate_and_repair) or a ValueError for each job
+    """
+    validation_config = get_validation_config()
+    if not validation_config['enabled']:
+        return [{"checked": 0, "repaired": [], "errors": {}} for _ in jobs]
+
+    files = [_generated_files(changes, new_files, selected) for _, changes, new_files, selected, _ in jobs]
+    errors = [_new_errors(job_files, job[0], root, validation_config) for job_files, job in zip(files, jobs)]
+    broken = [set(job_errors) for job_errors in errors]
+    for attempt in range(validation_config['repair_attempts']):
+        pending = [i for i, job_errors in enumerate(errors) if job_errors]
+        if not pending:
+            break
+        logger.info(f"Repairing files in {len(pending)} jobs that failed validation (attempt {attempt + 1})")
+        results = batch_chat_completion(
+            [repair_messages({path: files[i][path] for path in errors[i]}, errors[i], jobs[i][4]) for i in pending],
+            model,
+            stats_queue=stats_queue,
+            json_output=True,
+            extract_code_block=True
+        )
+        for i, result in zip(pending, results):
+            _, changes, new_files, selected, _ = jobs[i]
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                _merge_repair(changes, new_files, errors[i], result)
+            except Exception as e:
+                logger.error(f"Repair request failed: {str(e)}")
+                continue
+            files[i] = _generated_files(changes, new_files, selected)
+            errors[i] = _new_errors({path: files[i][path] for path in errors[i]}, jobs[i][0], root, validation_config)
+
+    reports = []
+    for job_files, job_errors, job_broken in zip(files, errors, broken):
+        try:
+            reports.append(_report(len(job_files), sorted(job_broken - set(job_errors)), job_errors, validation_config))
+        except ValueError as e:
+            reports.append(e)
+    return reports
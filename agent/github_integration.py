@@ -1,24 +1,55 @@
 """github_integration.py - GitHub API integration for GitIQ"""
 import os
-import json
+import re
 import time
 import logging
+import functools
 import threading
-from github import Github, PullRequest
-from github.GithubException import GithubException
-from github.IssueComment import IssueComment
-from github.PullRequestComment import PullRequestComment
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from config import get_config
+from llm_integration import select_model
+from pr_comment_edits import edit_pr_branch
+from repo_registry import repository_for_github
+from tracing import span, set_attributes, record_error
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_COMMENT_PROCESSOR_CONFIG = {
+    # Comments containing this are turned into edit jobs
+    "mention": "@gitiq-bot",
+    # Edit jobs run in parallel across PRs, one at a time per PR
+    "workers": 4,
+    "poll_interval": 60,
+    # Older comments are ignored so a first start does not replay old requests
+    "max_comment_age": 24 * 60 * 60,
+    # Only comments by authors with one of these associations to the repository,
+    # or by the listed GitHub logins, start edit jobs
+    "allowed_associations": ["OWNER", "MEMBER", "COLLABORATOR"],
+    "allowed_users": []
+}
+
+# Bot replies end with this marker naming the comment they answer
+REPLY_MARKER = re.compile(r'<!-- gitiq-comment:(\d+) -->')
+
+# Background comment processor state, see start/stop_pr_comment_processor
+_processor_thread = None
+_processor_stop = threading.Event()
+_executor = None
+
+# PR number -> edit jobs waiting behind the one running for that PR
+_pr_jobs = {}
+_pr_jobs_lock = threading.Lock()
+# Comment ids already dispatched by this process
+_handled_comments = set()
+
 def load_github_config():
     """Load GitHub configuration from config.json"""
-    with open('config.json') as f:
-        config = json.load(f)
-    return config.get('github', {})
+    return get_config().get('github', {})
 
-def create_github_pr(pr_title, branch_name, pr_description, base_branch):
-    """Create a GitHub Pull Request"""
+def create_github_pr(pr_title, branch_name, pr_description, base_branch, repo_owner=None, repo_name=None):
+    """Create a GitHub Pull Request (repo_owner/repo_name default to config.json)"""
     github_config = load_github_config()
     
     if not github_config.get('enabled', False):
@@ -26,24 +57,29 @@ def create_github_pr(pr_title, branch_name, pr_description, base_branch):
         return None
 
     access_token = os.getenv(github_config.get('access_token'))
-    repo_owner = github_config.get('repo_owner')
-    repo_name = github_config.get('repo_name')
+    repo_owner = repo_owner or github_config.get('repo_owner')
+    repo_name = repo_name or github_config.get('repo_name')
 
     if not all([access_token, repo_owner, repo_name]):
         logger.error("Missing required GitHub configuration")
         raise ValueError("Incomplete GitHub configuration")
 
+    # PyGithub is imported on first use to keep application startup fast
+    from github import Github
+    from github.GithubException import GithubException
+
     try:
-        g = Github(access_token)
-        repo = g.get_repo(f"{repo_owner}/{repo_name}")
-        
-        # Create pull request
-        pr = repo.create_pull(
-            title=pr_title,
-            body=pr_description,
-            head=branch_name,
-            base=base_branch  # Use the specified base_branch
-        )
+        with span("github.create_pull", repo=f"{repo_owner}/{repo_name}", head=branch_name, base=base_branch):
+            g = Github(access_token)
+            repo = g.get_repo(f"{repo_owner}/{repo_name}")
+
+            # Create pull request
+            pr = repo.create_pull(
+                title=pr_title,
+                body=pr_description,
+                head=branch_name,
+                base=base_branch  # Use the specified base_branch
+            )
         
         logger.info(f"Created GitHub PR: {pr.html_url}")
         return pr.html_url
@@ -55,9 +91,125 @@ def create_github_pr(pr_title, branch_name, pr_description, base_branch):
         logger.error(f"Unexpected error creating GitHub PR: {str(e)}")
         raise
 
-def process_pr_comments():
-    """Start a background thread to process PR comments"""
+def _comment_processor_config():
+    return {**DEFAULT_COMMENT_PROCESSOR_CONFIG, **load_github_config().get('comment_processor', {})}
+
+def _dispatch(pr_number, job):
+    """Run job on the worker pool after any earlier jobs for the same PR"""
+    with _pr_jobs_lock:
+        if pr_number in _pr_jobs:
+            _pr_jobs[pr_number].append(job)
+            return
+        _pr_jobs[pr_number] = []
+    _executor.submit(_run_pr_jobs, pr_number, job)
+
+def _run_pr_jobs(pr_number, job):
+    """Run a PR's jobs one after another on a single worker"""
+    while job is not None:
+        try:
+            job()
+        except Exception:
+            logger.exception(f"Comment job for PR #{pr_number} failed")
+        with _pr_jobs_lock:
+            pending = _pr_jobs[pr_number]
+            if pending and not _processor_stop.is_set():
+                job = pending.pop(0)
+            else:
+                del _pr_jobs[pr_number]
+                job = None
+
+def _reply(pr, comment, path, body):
+    """Reply in the review thread for review comments, on the PR otherwise"""
+    with span("github.reply", pr=pr.number, comment_id=comment.id):
+        if path:
+            pr.create_review_comment_reply(comment.id, body)
+        else:
+            pr.create_issue_comment(body)
+
+def _handle_edit_comment(pr, comment, path, repo_id, dispatched_at):
+    """Apply the edit requested in a comment to the PR branch and reply with the outcome"""
+    logger.info(f"Processing comment ID {comment.id} on PR #{pr.number}")
+    with span("job.pr_comment_edit", pr=pr.number, comment_id=comment.id, repo=repo_id,
+              queue_wait_ms=(time.time() - dispatched_at) * 1000):
+        try:
+            if pr.head.repo is None or pr.head.repo.full_name != pr.base.repo.full_name:
+                raise ValueError("PRs from forks are not supported")
+            if path:
+                file_paths = [path]
+            else:
+                with span("github.get_files", pr=pr.number):
+                    file_paths = [f.filename for f in pr.get_files() if f.status != 'removed']
+            model = select_model()
+            set_attributes(model=model, branch=pr.head.ref)
+            summary, commit_sha = edit_pr_branch(repo_id, pr.head.ref, comment.body, file_paths, model)
+            if commit_sha:
+                response = f"GitIQ: Pushed {commit_sha[:8]} to `{pr.head.ref}` (model: {model}).\n\n{summary}"
+            else:
+                response = f"GitIQ: No changes were needed.\n\n{summary}"
+        except Exception as e:
+            logger.error(f"Error processing comment ID {comment.id} in PR #{pr.number}: {str(e)}")
+            record_error(e)
+            response = f"GitIQ: I couldn't apply this change: {str(e)}"
+        _reply(pr, comment, path, f"{response}\n\n<!-- gitiq-comment:{comment.id} -->")
+    logger.info(f"Responded to comment ID {comment.id} in PR #{pr.number}")
+
+def _may_request_edits(comment, processor_config):
+    """Whether the comment's author may have the bot push commits at the project's API cost"""
+    login = comment.user.login if comment.user else None
+    return (getattr(comment, 'author_association', None) in processor_config['allowed_associations']
+            or login in processor_config['allowed_users'])
+
+def _poll_comments(repo, repo_id, processor_config, pr_updated):
+    """Dispatch an edit job for every new mention on the open PRs that changed since the last poll"""
+    mention = processor_config['mention']
+    oldest = datetime.now(timezone.utc) - timedelta(seconds=processor_config['max_comment_age'])
+    open_prs = list(repo.get_pulls(state='open'))
+    for stale in set(pr_updated) - {pr.number for pr in open_prs}:
+        del pr_updated[stale]
+
+    for pr in open_prs:
+        if pr_updated.get(pr.number) == pr.updated_at:
+            continue
+        comments = list(pr.get_issue_comments()) + list(pr.get_review_comments())
+
+        # Our replies carry the id of the comment they answer, so a restart does not redo them
+        answered = set()
+        for comment in comments:
+            if comment.body and comment.body.startswith('GitIQ:'):
+                answered.update(int(comment_id) for comment_id in REPLY_MARKER.findall(comment.body))
+
+        for comment in comments:
+            if not comment.body or mention not in comment.body or comment.body.startswith('GitIQ:'):
+                continue
+            created = comment.created_at
+            if created.tzinfo is None:
+                created = created.replace(tzinfo=timezone.utc)
+            if comment.id in answered or comment.id in _handled_comments or created < oldest:
+                continue
+            _handled_comments.add(comment.id)
+            if not _may_request_edits(comment, processor_config):
+                logger.info(f"Ignoring comment ID {comment.id} on PR #{pr.number}: "
+                            f"{getattr(comment, 'author_association', None)} authors may not request edits")
+                continue
+            # Review comments are attached to a file; issue comments have no path
+            path = getattr(comment, 'path', None)
+            _dispatch(pr.number, functools.partial(_handle_edit_comment, pr, comment, path, repo_id, time.time()))
+        pr_updated[pr.number] = pr.updated_at
+
+def start_pr_comment_processor():
+    """
+    Start the background thread that turns PR comments into edit jobs (idempotent).
+
+    Comments mentioning the bot are applied to the PR branch by a worker pool:
+    jobs for one PR run in order, different PRs run in parallel.
+    """
+    global _processor_thread, _executor
+    if _processor_thread is not None and _processor_thread.is_alive():
+        return _processor_thread
+
     def comment_processor():
+        from github import Github
+
         github_config = load_github_config()
         if not github_config.get('enabled', False):
             logger.warning("GitHub integration not enabled, skipping PR comment processing")
@@ -73,57 +225,40 @@ def process_pr_comments():
 
         g = Github(access_token)
         repo = g.get_repo(f"{repo_owner}/{repo_name}")
+        repo_id = repository_for_github(repo_owner, repo_name)
+        pr_updated = {}
 
-        while True:
+        while not _processor_stop.is_set():
+            processor_config = _comment_processor_config()
             try:
-                # Get all open PRs
-                open_prs = repo.get_pulls(state='open')
-                
-                for pr in open_prs:
-                    # Get issue comments that mention @GitIQ
-                    issue_comments = pr.get_issue_comments()
-                    for comment in issue_comments:
-                        if not isinstance(comment, IssueComment):
-                            continue
-                        if not hasattr(comment, 'body'):
-                            logger.warning(f"Comment ID {comment.id} does not have a body.")
-                            continue
-                        logger.info(f"Processing issue comment ID {comment.id}: {comment.body}")
-                        if '@gitiq-bot' in comment.body and not comment.body.startswith('GitIQ:'):
-                            try:
-                                # Process the comment and generate a response
-                                response = "GitIQ: I'll help with that. This feature is coming soon!"
-                                pr.create_issue_comment(response)
-                                logger.info(f"Responded to issue comment in PR #{pr.number} with ID {comment.id}")
-                            except Exception as e:
-                                logger.error(f"Error processing issue comment in PR #{pr.number}: {str(e)}")
-
-                    # Get review comments that mention @GitIQ
-                    review_comments = pr.get_review_comments()
-                    for review_comment in review_comments:
-                        if not isinstance(review_comment, PullRequestComment):
-                            continue
-                        if not hasattr(review_comment, 'body'):
-                            logger.warning(f"Review comment ID {review_comment.id} does not have a body.")
-                            continue
-                        logger.info(f"Processing review comment ID {review_comment.id}: {review_comment.body}")
-                        if '@gitiq-bot' in review_comment.body and not review_comment.body.startswith('GitIQ:'):
-                            try:
-                                # Process the review comment and generate a response
-                                response = "GitIQ: I'll assist with that change. Updating the code accordingly."
-                                pr.create_issue_comment(response)
-                                logger.info(f"Responded to review comment in PR #{pr.number} with ID {review_comment.id}")
-                            except Exception as e:
-                                logger.error(f"Error processing review comment in PR #{pr.number}: {str(e)}")
-
-                # Sleep for a while before checking again
-                time.sleep(60)  # Check every minute
-
+                _poll_comments(repo, repo_id, processor_config, pr_updated)
+                _processor_stop.wait(processor_config['poll_interval'])
             except Exception as e:
                 logger.error(f"Error in PR comment processor: {str(e)}")
-                time.sleep(300)  # On error, wait 5 minutes before retrying
+                _processor_stop.wait(300)  # On error, wait 5 minutes before retrying
+
+        logger.info("PR comment processor stopped")
 
     # Start the comment processor in a background thread
-    thread = threading.Thread(target=comment_processor, daemon=True)
-    thread.start()
+    _processor_stop.clear()
+    _executor = ThreadPoolExecutor(
+        max_workers=_comment_processor_config()['workers'],
+        thread_name_prefix="pr-comment-worker"
+    )
+    _processor_thread = threading.Thread(target=comment_processor, name="pr-comment-processor", daemon=True)
+    _processor_thread.start()
     logger.info("Started PR comment processor thread")
+    return _processor_thread
+
+def stop_pr_comment_processor(timeout=5.0):
+    """Signal the PR comment processor to stop and wait for it to exit; running edit jobs finish, queued ones are dropped"""
+    global _processor_thread, _executor
+    _processor_stop.set()
+    if _processor_thread is not None:
+        _processor_thread.join(timeout)
+        if _processor_thread.is_alive():
+            logger.warning("PR comment processor did not stop within timeout")
+        _processor_thread = None
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,141 @@
+"""http_cache.py - ETags, 304 responses, memoized bodies and compression for read endpoints"""
+import os
+import gzip
+import hashlib
+import logging
+
+from flask import Response, current_app, request
+
+# brotli is optional; without it responses are gzip-compressed only
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+
+def make_etag(*parts) -> str:
+    """Build a strong ETag from cheap state tokens."""
+    return '"' + hashlib.sha1(repr(parts).encode('utf-8')).hexdigest() + '"'
+
+def _mtime(path: str):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def head_token(repo) -> tuple:
+    """Return (HEAD file contents, HEAD sha): changes on checkout and on commit."""
+    try:
+        with open(os.path.join(repo.git_dir, 'HEAD')) as f:
+            head_ref = f.read().strip()
+    except OSError:
+        head_ref = None
+    try:
+        head_sha = repo.head.commit.hexsha
+    except ValueError:
+        # Unborn branch, no commits yet
+        head_sha = None
+    return head_ref, head_sha
+
+def refs_token(repo) -> tuple:
+    """
+    Return the newest mtime under refs/ plus packed-refs.
+
+    Git updates a ref by renaming a lock file into place, which bumps the
+    mtime of the directory holding it, so directory mtimes are enough.
+    """
+    common_dir = getattr(repo, 'common_dir', repo.git_dir)
+    newest = 0
+    for dir_path, _, _ in os.walk(os.path.join(common_dir, 'refs')):
+        newest = max(newest, _mtime(dir_path) or 0)
+    return newest, _mtime(os.path.join(common_dir, 'packed-refs'))
+
+def git_state_token(repo) -> tuple:
+    """Return HEAD, index and refs state; any commit, stage or branch change alters it."""
+    return head_token(repo), _mtime(os.path.join(repo.git_dir, 'index')), refs_token(repo)
+
+def worktree_token(root: str, file_paths) -> str:
+    """
+    Fingerprint the working tree from stat() of known files and all their ancestor directories.
+
+    Edits change a file's mtime/size, and adding or removing a file changes
+    its directory's mtime, so this detects changes without reading content.
+    Every ancestor up to root is included, since a new file in a new
+    subdirectory only shows up as a change to the new directory's parent.
+    """
+    digest = hashlib.sha1()
+    # Relative to root; '' is root itself
+    directories = {''}
+    for file_path in sorted(file_paths):
+        full_path = os.path.join(root, file_path)
+        directory = os.path.dirname(file_path)
+        while directory and directory not in directories:
+            directories.add(directory)
+            directory = os.path.dirname(directory)
+        try:
+            stat = os.stat(full_path)
+            digest.update(f"{file_path}\0{stat.st_mtime_ns}\0{stat.st_size}\n".encode('utf-8'))
+        except OSError:
+            digest.update(f"{file_path}\0missing\n".encode('utf-8'))
+    for directory in sorted(directories):
+        digest.update(f"{directory}\0{_mtime(os.path.join(root, directory))}\n".encode('utf-8'))
+    return digest.hexdigest()
+
+def _etag_matches(etag: str) -> bool:
+    if_none_match = request.headers.get('If-None-Match', '')
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return etag in candidates or f"W/{etag}" in candidates
+
+def _choose_encoding(body_size: int) -> str:
+    """Pick the best encoding the client accepts, or 'identity'."""
+    if body_size < MIN_COMPRESS_SIZE:
+        return 'identity'
+    accepted = {
+        part.split(';')[0].strip().lower()
+        for part in request.headers.get('Accept-Encoding', '').split(',')
+    }
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return 'identity'
+
+def _encode(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+def cached_json_response(cache: dict, key: str, etag: str, build) -> Response:
+    """
+    Serve build()'s JSON for the given ETag, answering 304 when the client has it.
+
+    The serialized body (and each compressed variant) is memoized in
+    cache[key] until the ETag changes, so unchanged polls do no work beyond
+    computing the ETag.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if _etag_matches(etag):
+        return Response(status=304, headers=headers)
+
+    memo = cache.get(key)
+    if memo is None or memo['etag'] != etag:
+        body = current_app.json.dumps(build()).encode('utf-8') + b'\n'
+        memo = {"etag": etag, "bodies": {"identity": body}}
+        cache[key] = memo
+
+    encoding = _choose_encoding(len(memo['bodies']['identity']))
+    body = memo['bodies'].get(encoding)
+    if body is None:
+        body = _encode(memo['bodies']['identity'], encoding)
+        memo['bodies'][encoding] = body
+    if encoding != 'identity':
+        headers["Content-Encoding"] = encoding
+    return Response(body, mimetype='application/json', headers=headers)
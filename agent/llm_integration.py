@@ -4,43 +4,141 @@ import re
 import json
 import logging
 import importlib
-from typing import Dict, List, Optional, Union
+import time
+from typing import Callable, Dict, List, Optional, Union
 from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 
-import openai
-import anthropic
-from anthropic import Anthropic
-import tiktoken
+from config import get_config, on_config_reload, set_config_path
+from usage_ledger import record_call, choose_model
+from tracing import span, propagate
+
+# Provider SDKs and tokenizer data are imported on first use so that importing
+# this module (and starting the web app) stays fast.
+openai = None
+anthropic = None
+tiktoken = None
 
 logger = logging.getLogger(__name__)
 
 # Module level config
 _llm_apis = None
 _models = None
-_last_api_base = None
+_encodings = {}
+_import_lock = threading.Lock()
+_reload_registered = False
 
-def load_llm_config(config_path: str) -> None:
-    """Load LLM configuration from a JSON file."""
+DEFAULT_BATCH_CONFIG = {
+    # Concurrent requests when a provider batch API is not used
+    "max_workers": 4,
+    # Request starts per minute for the concurrent fallback (0 = unlimited)
+    "requests_per_minute": 60,
+    # Seconds between provider batch status polls
+    "poll_interval": 30,
+    # Provider batch APIs are only used for at least this many requests
+    "min_batch_size": 2,
+    # Seconds before an unfinished provider batch is cancelled
+    "timeout": 86400,
+    # Largest number of jobs accepted by /api/batch
+    "max_jobs": 500
+}
+
+DEFAULT_CONTINUATION_CONFIG = {
+    # Follow-up requests made when a response stops at max_output_tokens
+    # (a model's "max_continuations" overrides this); 0 disables continuation
+    "max_continuations": 3
+}
+
+# A newline, or an escaped newline inside a JSON string
+LINE_BREAK = re.compile(r'\n|\\n')
+# Only this much of the end of a cut off output is searched for line breaks
+LINE_SEARCH_CHARS = 4000
+# A continuation starting with the last complete line is only taken to repeat
+# it if the line is at least this long; short lines repeat legitimately
+MIN_REPEATED_LINE_CHARS = 12
+
+CONTINUE_PROMPT = (
+    "Your response was cut off because it reached the output length limit; it is shown above up to its "
+    "last complete line. Continue with the next line exactly as the rest of the response would be. "
+    "Do not repeat any of it and do not add an introduction, code fences or commentary."
+)
+
+def _apply_llm_config(config: dict) -> None:
+    """Update the module level LLM config from a parsed config.json."""
     global _llm_apis, _models
-    with open(config_path) as f:
-        config = json.load(f)
     _llm_apis = config['llm_apis']
     _models = config['models']
 
+def load_llm_config(config_path: str) -> None:
+    """Load LLM configuration from a JSON file; it is reloaded when the file changes."""
+    global _reload_registered
+    set_config_path(config_path)
+    if not _reload_registered:
+        on_config_reload(_apply_llm_config)
+        _reload_registered = True
+    get_config()
+
+def _refresh_llm_config() -> None:
+    """Pick up config.json edits if load_llm_config has been called."""
+    if _models is not None:
+        get_config()
+
 def list_models():
     """Returns list of available model names."""
+    _refresh_llm_config()
     if _models is None:
         raise RuntimeError("Call load_llm_config before using list_models")
     return list(_models.keys())
 
-def _ensure_openai_configured(api_base: str, api_key: str) -> None:
-    """Ensure OpenAI is configured correctly for the current request."""
-    global _last_api_base
-    if _last_api_base != api_base:
-        os.environ["OPENAI_API_BASE"] = api_base
-        importlib.reload(openai)
-        _last_api_base = api_base
-    openai.api_key = api_key
+def select_model(requested: Optional[str] = None) -> str:
+    """
+    Resolve the model to use for a request.
+
+    Uses the requested model if given, else "default_model" from config.json.
+    The value "auto" picks the best model observed in the usage ledger, falling
+    back to the first configured model while there is not enough data.
+    """
+    models = list_models()
+    model_name = requested or get_config().get('default_model', 'auto')
+    if model_name != 'auto':
+        return model_name
+    candidates = get_config().get('model_selection', {}).get('candidates', models)
+    return choose_model(candidates) or candidates[0]
+
+def _get_openai():
+    """Import the openai SDK on first use."""
+    global openai
+    if openai is None:
+        with _import_lock:
+            if openai is None:
+                openai = importlib.import_module('openai')
+    return openai
+
+def _get_anthropic():
+    """Import the anthropic SDK on first use."""
+    global anthropic
+    if anthropic is None:
+        with _import_lock:
+            if anthropic is None:
+                anthropic = importlib.import_module('anthropic')
+    return anthropic
+
+def _get_encoding(model_name: str):
+    """Return the (cached) tiktoken encoding for a model, importing tiktoken on first use."""
+    global tiktoken
+    encoding = _encodings.get(model_name)
+    if encoding is not None:
+        return encoding
+    with _import_lock:
+        if tiktoken is None:
+            tiktoken = importlib.import_module('tiktoken')
+        try:
+            encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        _encodings[model_name] = encoding
+    return encoding
 
 def _format_messages_for_claude(messages: List[Dict[str, str]]) -> tuple[str, List[Dict]]:
     """Format messages for Claude API, separating system message."""
@@ -60,6 +158,7 @@ def calculate_cost(prompt_tokens: int, completion_tokens: int, model_name: str)
     Returns:
         Total cost in USD
     """
+    _refresh_llm_config()
     if _models is None:
         raise RuntimeError("Call load_llm_config before using calculate_cost")
     model = _models.get(model_name)
@@ -70,43 +169,24 @@ def calculate_cost(prompt_tokens: int, completion_tokens: int, model_name: str)
     cost_total = (prompt_tokens * cost[0] + completion_tokens * cost[1]) / 1000
     return cost_total
 
-def chat_completion(
-    messages: List[Dict[str, str]],
-    model_name: str,
-    stats_queue: Optional[Queue] = None,
-    extract_code_block: bool = False,
-    json_output: bool = False,
-    **kwargs
-) -> Union[str, Dict]:
+def _prepare_request(model_name: str, messages: List[Dict[str, str]], json_output: bool, kwargs: Dict) -> tuple:
     """
-    Create a chat completion using the specified model.
-
-    Args:
-        messages: List of message dictionaries with 'role' and 'content'
-        model_name: Name of the model to use from config
-        stats_queue: Optional queue to collect usage statistics
-        extract_code_block: Whether to extract content from code blocks
-        json_output: Whether to parse the output as JSON
-        **kwargs: Additional arguments to pass to the API
+    Look up a model and adapt messages/kwargs to it.
 
     Returns:
-        The completion text or parsed JSON object
+        (model config, API config, messages); kwargs is updated in place
     """
+    _refresh_llm_config()
     if _llm_apis is None or _models is None:
         raise RuntimeError("Call load_llm_config before using chat_completion")
 
-    logger.debug(f"LLM Input:\n{messages}\nLLM Metadata: {kwargs}")
-    
     model = _models.get(model_name)
     if not model:
         logger.error(f"Model {model_name} not found in configuration")
         raise ValueError(f"Model {model_name} not found.")
-    max_output_tokens = model.get('max_output_tokens', 4000)
-    temperature = model.get('temperature', 0.1)
     if not model.get('nojson', False) and json_output:
         kwargs['response_format'] = {"type": "json_object"}
     api_config = _llm_apis[model['llm_api']]
-    api_type = api_config.get('api_type', 'openai')
 
     # Handle models that don't support system messages
     if model.get('nosystem', False):
@@ -114,43 +194,127 @@ def chat_completion(
             "role": "user" if msg["role"] == "system" else msg["role"],
             "content": msg["content"]
         } for msg in messages]
+    return model, api_config, messages
+
+def get_continuation_config() -> dict:
+    """Return continuation settings from the "continuation" section of config.json."""
+    return {**DEFAULT_CONTINUATION_CONFIG, **get_config().get('continuation', {})}
+
+def _usage(prompt_tokens: int, completion_tokens: int, model_name: str) -> Dict:
+    """Usage dict for one request, with its cost in USD"""
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "cost": calculate_cost(prompt_tokens, completion_tokens, model_name)
+    }
+
+def _estimate_tokens(text: str, model_name: str) -> int:
+    """Token count for providers that do not report usage on streamed responses"""
+    try:
+        return count_tokens(text, model_name)
+    except ImportError:
+        return len(text) // 4
+
+def _stream_openai(request: Dict) -> tuple[str, Optional[str], Optional[float], Optional[Dict]]:
+    """
+    Send a streamed OpenAI-compatible chat request.
+
+    Returns:
+        (output text, finish reason, time to first token in ms, usage reported
+        by the provider or None)
+    """
+    start_time = time.time()
+    ttft_ms = None
+    finish_reason = None
+    usage = None
+    parts = []
+    for chunk in _get_openai().ChatCompletion.create(
+        stream=True,
+        # Asks for a final chunk with token usage; providers without it are estimated
+        stream_options={"include_usage": True},
+        **request
+    ):
+        if chunk.get('error'):
+            raise ValueError(f"Error from OpenAI API: {chunk['error'].get('message', 'Unknown error')}")
+        if chunk.get('usage'):
+            usage = chunk['usage']
+        for choice in chunk.get('choices') or []:
+            content = (choice.get('delta') or {}).get('content')
+            if content:
+                if ttft_ms is None:
+                    ttft_ms = (time.time() - start_time) * 1000
+                parts.append(content)
+            if choice.get('finish_reason'):
+                finish_reason = choice['finish_reason']
+    return "".join(parts), finish_reason, ttft_ms, usage
+
+def _call_provider(
+    model: Dict,
+    api_config: Dict,
+    messages: List[Dict[str, str]],
+    model_name: str,
+    max_output_tokens: int,
+    temperature: float,
+    **kwargs
+) -> tuple[str, Dict, bool, Optional[float]]:
+    """
+    Send one request to the model's provider.
+
+    Responses are streamed to measure the time to the first token, unless
+    the model has "nostream": true.
+
+    Returns:
+        (output text, usage, truncated, time to first token in ms or None);
+        truncated is True if the output stopped because it reached
+        max_output_tokens. The text is not stripped, a continuation may
+        start with indentation.
+    """
+    api_type = api_config.get('api_type', 'openai')
+    stream = not model.get('nostream', False)
+    ttft_ms = None
 
     if api_type == 'openai':
-        _ensure_openai_configured(api_config['api_base'], os.getenv(api_config['api_key']))
-        try:
-            # Use custom max_tokens parameter name if specified in model config
-            max_tokens_param = model.get('max_tokens_parameter', 'max_tokens')
-            api_kwargs = kwargs.copy()
-            api_kwargs[max_tokens_param] = max_output_tokens
-            api_kwargs['temperature'] = temperature
-            response = openai.ChatCompletion.create(
-                model=model['name'],
-                messages=messages,
-                n=1,
-                stop=None,
-                **api_kwargs
-            )
-            llm_output = response['choices'][0]['message']['content'].strip()
-        except (KeyError, IndexError) as e:
-            error_message = response.get('error', {}).get('message', 'Unknown error')
-            logger.error(f"Error accessing response content: {str(e)}: response = {response}")
-            raise ValueError(f"Error from OpenAI API: {error_message}")
-        # Calculate cost in USD
-        cost_total = calculate_cost(
-            response['usage']['prompt_tokens'],
-            response['usage']['completion_tokens'],
-            model_name
+        # Use custom max_tokens parameter name if specified in model config
+        max_tokens_param = model.get('max_tokens_parameter', 'max_tokens')
+        api_kwargs = kwargs.copy()
+        api_kwargs[max_tokens_param] = max_output_tokens
+        api_kwargs['temperature'] = temperature
+        request = dict(
+            # Base URL and key go with each request: module-level settings would
+            # be shared by concurrent jobs using different providers
+            api_base=api_config['api_base'],
+            api_key=os.getenv(api_config['api_key']),
+            model=model['name'],
+            messages=messages,
+            n=1,
+            stop=None,
+            **api_kwargs
         )
-        usage = {
-            "prompt_tokens": response['usage']['prompt_tokens'],
-            "completion_tokens": response['usage']['completion_tokens'],
-            "total_tokens": response['usage']['total_tokens'],
-            "cost": cost_total
-        }
+        if stream:
+            llm_output, finish_reason, ttft_ms, response_usage = _stream_openai(request)
+            truncated = finish_reason == 'length'
+            if response_usage is None:
+                response_usage = {
+                    "prompt_tokens": _estimate_tokens("\n".join(m["content"] for m in messages), model['name']),
+                    "completion_tokens": _estimate_tokens(llm_output, model['name'])
+                }
+        else:
+            try:
+                response = _get_openai().ChatCompletion.create(**request)
+                truncated = response['choices'][0].get('finish_reason') == 'length'
+                llm_output = response['choices'][0]['message']['content']
+            except (KeyError, IndexError) as e:
+                error_message = response.get('error', {}).get('message', 'Unknown error')
+                logger.error(f"Error accessing response content: {str(e)}: response = {response}")
+                raise ValueError(f"Error from OpenAI API: {error_message}")
+            response_usage = response['usage']
+        usage = _usage(response_usage['prompt_tokens'], response_usage['completion_tokens'], model_name)
 
     elif api_type == 'anthropic':
         system_message, user_messages = _format_messages_for_claude(messages)
-        response = anthropic.Anthropic(api_key=os.getenv(api_config['api_key'])).messages.create(
+        client = _get_anthropic().Anthropic(api_key=os.getenv(api_config['api_key']))
+        request = dict(
             model=model['name'],
             system=system_message,
             messages=user_messages,
@@ -158,26 +322,96 @@ def chat_completion(
             temperature=temperature,
             **kwargs
         )
+        if stream:
+            start_time = time.time()
+            with client.messages.stream(**request) as response_stream:
+                for text in response_stream.text_stream:
+                    if text and ttft_ms is None:
+                        ttft_ms = (time.time() - start_time) * 1000
+                response = response_stream.get_final_message()
+        else:
+            response = client.messages.create(**request)
         llm_output = response.content[0].text
-        cost_total = calculate_cost(
-            response.usage.input_tokens,
-            response.usage.output_tokens,
-            model_name
-        )
-        usage = {
-            "prompt_tokens": response.usage.input_tokens,
-            "completion_tokens": response.usage.output_tokens,
-            "total_tokens": response.usage.input_tokens + response.usage.output_tokens,
-            "cost": cost_total
-        }
+        truncated = response.stop_reason == 'max_tokens'
+        usage = _usage(response.usage.input_tokens, response.usage.output_tokens, model_name)
     else:
         raise ValueError(f"Unsupported API type: {api_type}")
 
-    logger.debug(f"Usage: {usage}\nLLM Output: {llm_output}")
-    
-    if stats_queue is not None:
-        stats_queue.put(usage)
+    return llm_output, usage, truncated, ttft_ms
+
+def _last_line(llm_output: str) -> tuple[int, str]:
+    """
+    Find where the last complete line of cut off output ends.
+
+    Returns:
+        (end of the last complete line, or the output's length if there is
+        none, the text of that line or "" if its start was not found)
+    """
+    search_start = max(0, len(llm_output) - LINE_SEARCH_CHARS)
+    ends = [match.end() for match in LINE_BREAK.finditer(llm_output, search_start)]
+    if not ends:
+        return len(llm_output), ""
+    return ends[-1], llm_output[ends[-2]:ends[-1]] if len(ends) > 1 else ""
+
+def _stitch(llm_output: str, continuation: str, last_line: str) -> str:
+    """Append a continuation, dropping a code fence it reopens or the last line if it repeats it."""
+    # An answer that opened a code block may be continued with a new fence
+    if continuation.lstrip().startswith('```') and llm_output.count('```') % 2 == 1:
+        continuation = continuation.lstrip().partition('\n')[2]
+    if len(last_line.strip()) >= MIN_REPEATED_LINE_CHARS and continuation.startswith(last_line):
+        continuation = continuation[len(last_line):]
+    return llm_output + continuation
+
+def _continue_output(
+    model: Dict,
+    api_config: Dict,
+    messages: List[Dict[str, str]],
+    model_name: str,
+    llm_output: str,
+    usage: Dict,
+    kwargs: Dict
+) -> tuple[str, Dict, int, bool]:
+    """
+    Request continuations of output that stopped at max_output_tokens and stitch them on.
 
+    Returns:
+        (output text, usage summed over all requests, continuations made,
+        whether the output is still truncated)
+    """
+    continuation_config = get_continuation_config()
+    max_continuations = model.get('max_continuations', continuation_config['max_continuations'])
+    # A JSON response format would make the model start a new JSON object
+    continuation_kwargs = {key: value for key, value in kwargs.items() if key != 'response_format'}
+    usage = dict(usage)
+    truncated = True
+    continuations = 0
+    while truncated and continuations < max_continuations:
+        continuations += 1
+        logger.info(f"Output of {model_name} reached max_output_tokens, requesting continuation {continuations}")
+        # Resume from a line boundary rather than from the middle of a token
+        line_end, last_line = _last_line(llm_output)
+        llm_output = llm_output[:line_end]
+        continuation, continuation_usage, truncated, _ = _call_provider(
+            model,
+            api_config,
+            messages + [
+                {"role": "assistant", "content": llm_output},
+                {"role": "user", "content": CONTINUE_PROMPT}
+            ],
+            model_name,
+            model.get('max_output_tokens', 4000),
+            model.get('temperature', 0.1),
+            **continuation_kwargs
+        )
+        llm_output = _stitch(llm_output, continuation, last_line)
+        for key, value in continuation_usage.items():
+            usage[key] = usage.get(key, 0) + value
+    if truncated:
+        logger.warning(f"Output of {model_name} is still truncated after {continuations} continuations")
+    return llm_output, usage, continuations, truncated
+
+def _process_output(llm_output: str, model: Dict, extract_code_block: bool, json_output: bool) -> Union[str, Dict]:
+    """Apply model-specific cleanup, code block extraction and JSON parsing to raw output."""
     # Handle model-specific output manipulation
     if "Reflection" in model['name']:
         match = re.search(r'<output>(.*)</output>', llm_output, re.DOTALL | re.IGNORECASE)
@@ -237,6 +471,307 @@ def chat_completion(
     else:
         return llm_output
 
+def chat_completion(
+    messages: List[Dict[str, str]],
+    model_name: str,
+    stats_queue: Optional[Queue] = None,
+    extract_code_block: bool = False,
+    json_output: bool = False,
+    **kwargs
+) -> Union[str, Dict]:
+    """
+    Create a chat completion using the specified model.
+
+    Output that stops at the model's max_output_tokens is completed with up to
+    max_continuations follow-up requests; the returned usage covers all of them.
+
+    Args:
+        messages: List of message dictionaries with 'role' and 'content'
+        model_name: Name of the model to use from config
+        stats_queue: Optional queue to collect usage statistics
+        extract_code_block: Whether to extract content from code blocks
+        json_output: Whether to parse the output as JSON
+        **kwargs: Additional arguments to pass to the API
+
+    Returns:
+        The completion text or parsed JSON object
+    """
+    logger.debug(f"LLM Input:\n{messages}\nLLM Metadata: {kwargs}")
+    model, api_config, messages = _prepare_request(model_name, messages, json_output, kwargs)
+    max_output_tokens = model.get('max_output_tokens', 4000)
+    temperature = model.get('temperature', 0.1)
+
+    with span("llm.chat_completion", model=model_name, provider=model['llm_api']) as call_span:
+        start_time = time.time()
+        try:
+            llm_output, usage, truncated, ttft_ms = _call_provider(
+                model, api_config, messages, model_name, max_output_tokens, temperature, **kwargs
+            )
+            continuations = 0
+            if truncated:
+                llm_output, usage, continuations, truncated = _continue_output(
+                    model, api_config, messages, model_name, llm_output, usage, kwargs
+                )
+            llm_output = llm_output.strip()
+        except Exception as e:
+            record_call(model_name, model['llm_api'], None, (time.time() - start_time) * 1000, error=str(e))
+            raise
+        latency_ms = (time.time() - start_time) * 1000
+        record_call(model_name, model['llm_api'], usage, latency_ms, ttft_ms=ttft_ms)
+        call_span['attributes'].update({
+            key: value for key, value in usage.items() if isinstance(value, (int, float))
+        })
+        call_span['attributes'].update(latency_ms=latency_ms, continuations=continuations, truncated=truncated)
+        if ttft_ms is not None:
+            call_span['attributes']['ttft_ms'] = ttft_ms
+
+    logger.debug(f"Usage: {usage}\nLLM Output: {llm_output}")
+    
+    if stats_queue is not None:
+        # The span id lets consumers tie the usage to this call in the trace
+        stats_queue.put({**usage, "span_id": call_span['span_id']})
+
+    return _process_output(llm_output, model, extract_code_block, json_output)
+
+def get_batch_config() -> dict:
+    """Return batch settings from the "batch" section of config.json."""
+    return {**DEFAULT_BATCH_CONFIG, **get_config().get('batch', {})}
+
+def _rate_limiter(requests_per_minute: float) -> Callable[[], float]:
+    """Return a function that blocks so calls start at most requests_per_minute times a minute, returning the seconds waited."""
+    interval = 60.0 / requests_per_minute if requests_per_minute else 0
+    lock = threading.Lock()
+    next_start = [0.0]
+
+    def wait():
+        with lock:
+            now = time.time()
+            start = max(now, next_start[0])
+            next_start[0] = start + interval
+        if start > now:
+            time.sleep(start - now)
+        return start - now
+    return wait
+
+def _batch_usage(prompt_tokens: int, completion_tokens: int, model_name: str, model: Dict) -> Dict:
+    """Usage dict for a provider batch result; batch requests are billed at a discount."""
+    usage = _usage(prompt_tokens, completion_tokens, model_name)
+    usage["cost"] *= model.get('batch_cost_factor', 0.5)
+    return usage
+
+def _openai_batch(model, api_config, requests_messages, model_name, kwargs, batch_config, progress):
+    """Run requests through the OpenAI Batch API; returns (output, usage, truncated) or an Exception per request."""
+    import requests
+
+    api_base = api_config['api_base'].rstrip('/')
+    headers = {"Authorization": f"Bearer {os.getenv(api_config['api_key'])}"}
+    max_tokens_param = model.get('max_tokens_parameter', 'max_tokens')
+    lines = []
+    for i, messages in enumerate(requests_messages):
+        body = {
+            "model": model['name'],
+            "messages": messages,
+            max_tokens_param: model.get('max_output_tokens', 4000),
+            "temperature": model.get('temperature', 0.1),
+            **kwargs
+        }
+        lines.append(json.dumps({"custom_id": str(i), "method": "POST", "url": "/v1/chat/completions", "body": body}))
+
+    upload = requests.post(
+        f"{api_base}/files", headers=headers, data={"purpose": "batch"},
+        files={"file": ("gitiq_batch.jsonl", "\n".join(lines).encode('utf-8'))}, timeout=300
+    )
+    upload.raise_for_status()
+    response = requests.post(
+        f"{api_base}/batches", headers=headers, timeout=60,
+        json={"input_file_id": upload.json()['id'], "endpoint": "/v1/chat/completions", "completion_window": "24h"}
+    )
+    response.raise_for_status()
+    batch = response.json()
+    logger.info(f"Submitted OpenAI batch {batch['id']} with {len(lines)} requests")
+
+    deadline = time.time() + batch_config['timeout']
+    while batch['status'] not in ('completed', 'failed', 'expired', 'cancelled'):
+        if time.time() > deadline:
+            requests.post(f"{api_base}/batches/{batch['id']}/cancel", headers=headers, timeout=60)
+            raise TimeoutError(f"OpenAI batch {batch['id']} did not finish in time")
+        time.sleep(batch_config['poll_interval'])
+        response = requests.get(f"{api_base}/batches/{batch['id']}", headers=headers, timeout=60)
+        response.raise_for_status()
+        batch = response.json()
+        counts = batch.get('request_counts') or {}
+        if progress:
+            progress(counts.get('completed', 0) + counts.get('failed', 0), len(lines))
+
+    results = [RuntimeError(f"No result for request (batch {batch['status']})")] * len(lines)
+    for file_key in ('output_file_id', 'error_file_id'):
+        if not batch.get(file_key):
+            continue
+        response = requests.get(f"{api_base}/files/{batch[file_key]}/content", headers=headers, timeout=300)
+        response.raise_for_status()
+        for line in response.text.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            index = int(item['custom_id'])
+            item_response = item.get('response') or {}
+            if item.get('error') or item_response.get('status_code') != 200:
+                error = item.get('error') or item_response.get('body', {}).get('error') or {}
+                results[index] = ValueError(f"Error from OpenAI batch: {error.get('message', 'Unknown error')}")
+                continue
+            body = item_response['body']
+            results[index] = (
+                body['choices'][0]['message']['content'],
+                _batch_usage(body['usage']['prompt_tokens'], body['usage']['completion_tokens'], model_name, model),
+                body['choices'][0].get('finish_reason') == 'length'
+            )
+    return results
+
+def _anthropic_batch(model, api_config, requests_messages, model_name, kwargs, batch_config, progress):
+    """Run requests through the Anthropic Message Batches API; returns (output, usage, truncated) or an Exception per request."""
+    client = _get_anthropic().Anthropic(api_key=os.getenv(api_config['api_key']))
+    batches = getattr(client.messages, 'batches', None) or client.beta.messages.batches
+    batch_requests = []
+    for i, messages in enumerate(requests_messages):
+        system_message, user_messages = _format_messages_for_claude(messages)
+        batch_requests.append({
+            "custom_id": str(i),
+            "params": {
+                "model": model['name'],
+                "system": system_message,
+                "messages": user_messages,
+                "max_tokens": model.get('max_output_tokens', 4000),
+                "temperature": model.get('temperature', 0.1),
+                **kwargs
+            }
+        })
+    batch = batches.create(requests=batch_requests)
+    logger.info(f"Submitted Anthropic batch {batch.id} with {len(batch_requests)} requests")
+
+    deadline = time.time() + batch_config['timeout']
+    while batch.processing_status != 'ended':
+        if time.time() > deadline:
+            batches.cancel(batch.id)
+            raise TimeoutError(f"Anthropic batch {batch.id} did not finish in time")
+        time.sleep(batch_config['poll_interval'])
+        batch = batches.retrieve(batch.id)
+        counts = batch.request_counts
+        if progress:
+            progress(counts.succeeded + counts.errored + counts.canceled + counts.expired, len(batch_requests))
+
+    results = [RuntimeError("No result for request")] * len(batch_requests)
+    for item in batches.results(batch.id):
+        index = int(item.custom_id)
+        if item.result.type != 'succeeded':
+            results[index] = ValueError(f"Anthropic batch request {item.result.type}")
+            continue
+        message = item.result.message
+        results[index] = (
+            message.content[0].text,
+            _batch_usage(message.usage.input_tokens, message.usage.output_tokens, model_name, model),
+            message.stop_reason == 'max_tokens'
+        )
+    return results
+
+def batch_chat_completion(
+    requests_messages: List[List[Dict[str, str]]],
+    model_name: str,
+    stats_queue: Optional[Queue] = None,
+    extract_code_block: bool = False,
+    json_output: bool = False,
+    progress: Optional[Callable[[int, int], None]] = None,
+    provider_batch: bool = True,
+    **kwargs
+) -> List[Union[str, Dict, Exception]]:
+    """
+    Run many independent chat completions on one model.
+
+    Models with "batch_api": true in config.json submit the requests through
+    the provider's batch API (OpenAI Batch API or Anthropic Message Batches),
+    which is cheaper but can take minutes to hours; outputs cut off at
+    max_output_tokens are continued with direct requests. Otherwise the
+    requests are sent concurrently through chat_completion, limited by the
+    "batch" config's max_workers and requests_per_minute.
+
+    Args:
+        requests_messages: One messages list per request
+        model_name: Name of the model to use from config
+        stats_queue: Optional queue to collect usage statistics
+        extract_code_block: Whether to extract content from code blocks
+        json_output: Whether to parse the outputs as JSON
+        progress: Optional callback(done, total) as requests finish
+        provider_batch: False sends the requests concurrently even for "batch_api"
+            models, for callers that need the results right away
+        **kwargs: Additional arguments to pass to the API
+
+    Returns:
+        One result per request, in order: the completion text or parsed JSON
+        object, or the Exception raised for that request
+    """
+    if not requests_messages:
+        return []
+    batch_config = get_batch_config()
+    model, api_config, _ = _prepare_request(model_name, [], json_output, kwargs)
+    api_type = api_config.get('api_type', 'openai')
+    use_batch_api = (provider_batch and model.get('batch_api', False)
+                     and len(requests_messages) >= batch_config['min_batch_size'])
+
+    if use_batch_api and api_type in ('openai', 'anthropic'):
+        with span("llm.provider_batch", model=model_name, provider=model['llm_api'], requests=len(requests_messages)) as batch_span:
+            prepared = [_prepare_request(model_name, messages, json_output, {})[2] for messages in requests_messages]
+            submit_batch = _openai_batch if api_type == 'openai' else _anthropic_batch
+            raw_results = submit_batch(model, api_config, prepared, model_name, kwargs, batch_config, progress)
+            results = []
+            for messages, raw in zip(prepared, raw_results):
+                if isinstance(raw, Exception):
+                    results.append(raw)
+                    continue
+                llm_output, usage, truncated = raw
+                if truncated:
+                    # Continuations are sent directly, they are needed before the job can go on
+                    try:
+                        llm_output, usage, _, _ = _continue_output(
+                            model, api_config, messages, model_name, llm_output, usage, kwargs
+                        )
+                    except Exception as e:
+                        results.append(e)
+                        continue
+                llm_output = llm_output.strip()
+                for key, value in usage.items():
+                    if isinstance(value, (int, float)):
+                        batch_span['attributes'][key] = batch_span['attributes'].get(key, 0) + value
+                if stats_queue is not None:
+                    stats_queue.put({**usage, "span_id": batch_span['span_id']})
+                try:
+                    results.append(_process_output(llm_output, model, extract_code_block, json_output))
+                except Exception as e:
+                    results.append(e)
+        return results
+
+    wait_for_rate_limit = _rate_limiter(batch_config['requests_per_minute'])
+
+    def run(messages):
+        # Time spent waiting for the rate limit is recorded on the request's span
+        with span("llm.batch_request", model=model_name) as request_span:
+            request_span['attributes']['queue_wait_ms'] = wait_for_rate_limit() * 1000
+            return chat_completion(
+                messages, model_name, stats_queue=stats_queue,
+                extract_code_block=extract_code_block, json_output=json_output, **kwargs
+            )
+
+    results = [None] * len(requests_messages)
+    with span("llm.concurrent_batch", model=model_name, requests=len(requests_messages)):
+        with ThreadPoolExecutor(max_workers=batch_config['max_workers']) as pool:
+            futures = {pool.submit(propagate(run), messages): i for i, messages in enumerate(requests_messages)}
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    results[futures[future]] = e
+                if progress:
+                    progress(done, len(requests_messages))
+    return results
+
 def count_tokens(text: str, model_name: str = "gpt-3.5-turbo") -> int:
     """
     Count the number of tokens in a given text using the specified model's tokenizer.
@@ -248,9 +783,4 @@ def count_tokens(text: str, model_name: str = "gpt-3.5-turbo") -> int:
     Returns:
         The number of tokens in the text
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model_name)
-    except KeyError:
-        encoding = tiktoken.get_encoding("cl100k_base")
-    
-    return len(encoding.encode(text))
+    return len(_get_encoding(model_name).encode(text))
@@ -0,0 +1,111 @@
+"""pr_comment_edits.py - Apply an edit requested in a PR comment to the PR's branch"""
+import shutil
+import logging
+import tempfile
+
+from change_pipeline import apply_changes, commit_changes
+from chunked_edits import generate_changes
+from file_validation import validate_and_repair
+from repo_registry import locked_repo, TracedRepo
+
+logger = logging.getLogger(__name__)
+
+# Edits are generated again from the new head if the branch moves meanwhile
+BRANCH_MOVED_ATTEMPTS = 2
+
+def _fetch_branch(repo, branch):
+    """Fetch the PR branch from origin and return its head sha"""
+    repo.git.fetch('origin', branch)
+    return repo.git.rev_parse(f"origin/{branch}")
+
+def _read_files_at(repo, sha, file_paths):
+    """Read files as of a commit into {path: content}, skipping paths missing there"""
+    files_content = {}
+    for file_path in file_paths:
+        try:
+            files_content[file_path] = repo.git.show(f"{sha}:{file_path}", strip_newline_in_stdout=False)
+        except Exception as e:
+            logger.warning(f"Skipping {file_path}, not readable at {sha[:8]}: {str(e)}")
+    return files_content
+
+def _commit_in_worktree(repo, base_sha, branch, changes, new_files, file_paths, message, model):
+    """
+    Commit changes on top of base_sha in a temporary worktree and push it to origin's branch.
+
+    The user's working tree and local branches are never touched, so
+    uncommitted work and unpushed commits stay as they are.
+    """
+    worktree_dir = tempfile.mkdtemp(prefix="gitiq-pr-edit-")
+    repo.git.worktree('add', '--detach', worktree_dir, base_sha)
+    try:
+        worktree = TracedRepo(worktree_dir)
+        try:
+            modified_files = apply_changes({"path": worktree_dir}, worktree, changes, new_files, file_paths)
+            commit_changes(worktree, modified_files, message, model)
+            worktree.git.push('origin', f"HEAD:refs/heads/{branch}")
+            return worktree.head.commit.hexsha
+        finally:
+            worktree.close()
+    finally:
+        try:
+            repo.git.worktree('remove', '--force', worktree_dir)
+        except Exception as e:
+            logger.warning(f"Failed to remove worktree {worktree_dir}: {str(e)}")
+            shutil.rmtree(worktree_dir, ignore_errors=True)
+            repo.git.worktree('prune')
+
+def edit_pr_branch(repo_id, branch, prompt, file_paths, model, stats_queue=None):
+    """
+    Generate changes for a PR comment and push them to the PR's branch.
+
+    The repository lock is only held while reading the branch and while
+    committing, not during the LLM call. If the branch moved on origin in
+    between, the edit is generated once more from the new head. The commit
+    is made in a temporary worktree, so the working tree is left alone.
+
+    Args:
+        repo_id: Registry id of the local clone of the PR's repository
+        branch: PR head branch on origin
+        prompt: The comment text
+        file_paths: Files the edit may touch (the PR's files or the commented file)
+        model: Model name to use
+
+    Returns:
+        (summary, commit_sha), commit_sha is None if the LLM changed nothing
+
+    Raises:
+        ValueError: If none of the files exist on the branch, the LLM response is invalid
+            or the generated files fail validation
+        RuntimeError: If the branch moved on origin during both attempts
+    """
+    for attempt in range(BRANCH_MOVED_ATTEMPTS):
+        with locked_repo(repo_id) as entry:
+            repo = entry['repo']
+            base_sha = _fetch_branch(repo, branch)
+            files_content = _read_files_at(repo, base_sha, file_paths)
+        if not files_content:
+            raise ValueError(f"None of the files {file_paths} exist on branch '{branch}'")
+
+        changes, new_files, summary = generate_changes(
+            files_content, list(files_content), prompt, model, stats_queue=stats_queue
+        )
+        validate_and_repair(
+            files_content, changes, new_files, list(files_content), prompt, model,
+            root=entry['path'], stats_queue=stats_queue
+        )
+        changes = {path: content for path, content in changes.items() if files_content.get(path) != content}
+        if not changes and not new_files:
+            return summary, None
+
+        with locked_repo(repo_id) as entry:
+            repo = entry['repo']
+            if _fetch_branch(repo, branch) != base_sha:
+                logger.info(f"Branch '{branch}' was updated while the edit was generated (attempt {attempt + 1})")
+                continue
+            commit_sha = _commit_in_worktree(
+                repo, base_sha, branch, changes, new_files, list(files_content),
+                f"Address PR comment\n\nPrompt: {prompt}\n\nDescription: {summary}", model
+            )
+        logger.info(f"Pushed {commit_sha[:8]} to '{branch}' for PR comment")
+        return summary, commit_sha
+    raise RuntimeError(f"Branch '{branch}' was updated while the edit was generated")
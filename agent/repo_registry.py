@@ -0,0 +1,155 @@
+"""repo_registry.py - Long-lived, lock-protected Repo handles for served repositories"""
+import os
+import logging
+import threading
+from contextlib import contextmanager
+
+from git import Git, Repo
+
+from config import get_config, on_config_reload
+from tracing import child_span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPO_ID = 'default'
+
+# Captured at import: GitPython may chdir into a repository during index operations
+_startup_cwd = os.getcwd()
+
+# repo id -> {"id", "path", "config", "repo", "lock", "cache"}
+_repositories = {}
+_registry_lock = threading.Lock()
+_initialized = False
+
+class TracedGit(Git):
+    """Git command wrapper that records each git subprocess as a span of the current trace"""
+
+    def execute(self, command, *args, **kwargs):
+        argv = [command] if isinstance(command, str) else [str(part) for part in command]
+        name = f"git {argv[1]}" if len(argv) > 1 else "git"
+        with child_span(name, argv=" ".join(argv)[:200]):
+            return super().execute(command, *args, **kwargs)
+
+class TracedRepo(Repo):
+    GitCommandWrapperType = TracedGit
+
+def _absolute_path(path: str) -> str:
+    """Resolve a configured repository path relative to the startup directory."""
+    return os.path.abspath(os.path.join(_startup_cwd, path))
+
+def _configured_repositories(config: dict) -> dict:
+    """
+    Return {repo_id: repo_config} from the "repositories" list in config.json.
+
+    Without a "repositories" section the repository in the current working
+    directory is served under the id "default", as before.
+    """
+    repositories = config.get('repositories')
+    if not repositories:
+        return {DEFAULT_REPO_ID: {"id": DEFAULT_REPO_ID, "path": _startup_cwd}}
+    return {repo_config['id']: repo_config for repo_config in repositories}
+
+def _sync_registry(config: dict) -> None:
+    """Add/remove registry entries to match config.json, keeping open handles."""
+    configured = _configured_repositories(config)
+    with _registry_lock:
+        for repo_id in list(_repositories):
+            entry = _repositories[repo_id]
+            repo_config = configured.get(repo_id)
+            if repo_config is None or _absolute_path(repo_config['path']) != entry['path']:
+                # Drop rather than close: a request may still be using the handle
+                logger.info(f"Removing repository '{repo_id}' from registry")
+                del _repositories[repo_id]
+
+        for repo_id, repo_config in configured.items():
+            if repo_id in _repositories:
+                _repositories[repo_id]['config'] = repo_config
+                continue
+            _repositories[repo_id] = {
+                "id": repo_id,
+                "path": _absolute_path(repo_config['path']),
+                "config": repo_config,
+                "repo": None,
+                "lock": threading.RLock(),
+                "cache": {}
+            }
+
+def init_registry() -> None:
+    """Build the registry from config.json and keep it in sync with config reloads."""
+    global _initialized
+    if not _initialized:
+        on_config_reload(_sync_registry)
+        _initialized = True
+
+def list_repositories() -> list:
+    """Return the id and path of each served repository, in config order."""
+    get_config()
+    with _registry_lock:
+        return [{"id": entry['id'], "path": entry['path']} for entry in _repositories.values()]
+
+def get_repository(repo_id: str = None) -> dict:
+    """
+    Return the registry entry for repo_id (or the default repository).
+
+    Raises:
+        KeyError: If no repository with that id is configured
+    """
+    get_config()
+    with _registry_lock:
+        if repo_id is None:
+            repo_id = next(iter(_repositories), DEFAULT_REPO_ID)
+        if repo_id not in _repositories:
+            raise KeyError(f"Unknown repository '{repo_id}'")
+        return _repositories[repo_id]
+
+def repository_for_github(repo_owner: str, repo_name: str) -> str:
+    """
+    Return the id of the repository whose "github" settings name owner/name.
+
+    Repositories without their own "github" section use the global one, so
+    the first of those matches it; falls back to the default repository.
+    """
+    global_github = get_config().get('github', {})
+    with _registry_lock:
+        for entry in _repositories.values():
+            github_config = entry['config'].get('github', global_github)
+            if (github_config.get('repo_owner'), github_config.get('repo_name')) == (repo_owner, repo_name):
+                return entry['id']
+        return next(iter(_repositories), DEFAULT_REPO_ID)
+
+@contextmanager
+def locked_repo(repo_id: str = None):
+    """
+    Hold a repository's lock and yield its registry entry with entry["repo"] open.
+
+    The Repo handle is opened on first use and reused afterwards; GitPython
+    handles are not thread-safe, so all access goes through this lock. Inside
+    a trace, the wait for the lock and each git command are recorded as spans.
+
+    Raises:
+        KeyError: If no repository with that id is configured
+        InvalidGitRepositoryError, NoSuchPathError: If the path is not a Git repo
+    """
+    entry = get_repository(repo_id)
+    with child_span("repo.lock_wait", repo=entry['id']):
+        entry['lock'].acquire()
+    try:
+        if entry['repo'] is None:
+            entry['repo'] = TracedRepo(entry['path'])
+            logger.info(f"Opened repository '{entry['id']}' at {entry['path']}")
+        yield entry
+    finally:
+        entry['lock'].release()
+
+def resolve_repo_path(entry: dict, file_path: str) -> str:
+    """
+    Return the absolute path of file_path inside the repository.
+
+    Raises:
+        ValueError: If file_path points outside the repository
+    """
+    full_path = os.path.realpath(os.path.join(entry['path'], file_path))
+    root = os.path.realpath(entry['path'])
+    if full_path != root and not full_path.startswith(root + os.sep):
+        raise ValueError(f"Path '{file_path}' is outside the repository")
+    return full_path
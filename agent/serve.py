@@ -0,0 +1,63 @@
+"""serve.py - Production entry point for GitIQ using gevent's WSGI server
+
+    python agent/serve.py
+
+Each connection (including long-lived /api/pr/create/stream SSE connections)
+is a greenlet rather than an OS thread, so one process can hold many streaming
+jobs while they wait on LLM APIs. On SIGTERM/SIGINT the server stops accepting
+connections, lets running jobs finish (up to serving.drain_timeout seconds)
+and then exits.
+"""
+import os
+import sys
+
+# gevent must patch the standard library before anything else imports it
+try:
+    from gevent import monkey
+    monkey.patch_all()
+except ImportError:
+    sys.exit("serve.py requires gevent: pip install -r requirements.txt")
+
+import signal
+import logging
+
+import gevent
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+from app import create_app, start_background_workers, stop_background_workers
+from stream_events import get_serving_config, begin_drain, wait_for_drain
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 1000
+
+def main():
+    app = create_app()
+    serving_config = get_serving_config()
+    host = serving_config.get('host', '0.0.0.0')
+    port = int(os.environ.get('PORT', serving_config.get('port', 5500)))
+    max_connections = serving_config.get('max_connections', DEFAULT_MAX_CONNECTIONS)
+
+    server = WSGIServer((host, port), app, spawn=Pool(max_connections), log=None)
+
+    def shutdown():
+        logger.info("Shutting down: no longer accepting connections")
+        begin_drain()
+        # Not server.close(): that also ends serve_forever() and kills running jobs
+        server.stop_accepting()
+        server.socket.close()
+        wait_for_drain(serving_config['drain_timeout'])
+        stop_background_workers()
+        server.stop(timeout=5)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        gevent.signal_handler(signum, lambda: gevent.spawn(shutdown))
+
+    start_background_workers()
+    logger.info(f"Serving GitIQ on {host}:{port} "
+                f"(max {max_connections} connections, {serving_config['max_streams']} streaming jobs)")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
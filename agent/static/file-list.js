@@ -1,45 +1,105 @@
 function FileList(containerId) {
+    // Rows rendered above and below the visible part of the list
+    const OVERSCAN_ROWS = 10;
+    // Starting guesses; the real heights are measured from the first rendered rows
+    const DEFAULT_ROW_HEIGHT = 37;
+    const DEFAULT_DIFF_ROW_HEIGHT = 321;
+    const COLUMN_COUNT = 7;
+    // Sort order for the status column: changed files first
+    const STATUS_ORDER = { modified: 0, renamed: 1, untracked: 2, deleted: 3, unmodified: 4 };
+
     const container = document.getElementById(containerId);
+    const scroller = container.querySelector('.file-scroll');
+    const tbody = container.querySelector('tbody');
+    const filterInput = document.getElementById('fileFilter');
+    const statusFilter = document.getElementById('statusFilter');
+    const fileCount = document.getElementById('fileCount');
+    const selectAllCheckbox = document.getElementById('selectAll');
+
     const selectedFiles = new Set();
+    const expandedDiffs = new Set();
+    // path -> file entry from /api/files, with derived fields (_pathLower, _extension, ...)
+    const filesByPath = new Map();
     let filesData = [];
+    let filesEtag = null;
+    let extensionList = '';
+    // Sort key -> filesData sorted ascending by that key, rebuilt after files change
+    let sortIndex = {};
+    // Files passing the current filters, in display order, and the filters that produced them
+    let viewFiles = [];
+    let viewFilter = null;
+    // Flattened rows of viewFiles (file rows plus expanded diff rows) and their top offsets
+    let layoutItems = [];
+    let layoutOffsets = [];
+    let totalHeight = 0;
+    let rowHeight = DEFAULT_ROW_HEIGHT;
+    let diffRowHeight = DEFAULT_DIFF_ROW_HEIGHT;
+    // path -> {signature, row, diffRow} for the rows currently in the DOM, reused on scroll
+    let renderedRows = new Map();
+    let renderScheduled = false;
+    let filterScheduled = false;
     let currentSortKey = 'path';
     let currentSortOrder = 'asc';
     let onSelectionChange = null;
 
-    const selectAllCheckbox = document.getElementById('selectAll');
     selectAllCheckbox.addEventListener('change', handleSelectAll);
+    filterInput.addEventListener('input', scheduleFilter);
+    statusFilter.addEventListener('change', scheduleFilter);
+    scroller.addEventListener('scroll', scheduleRender, { passive: true });
+    window.addEventListener('resize', scheduleRender);
+    // One listener each for every row's checkbox and expand button
+    tbody.addEventListener('change', handleCheckboxChange);
+    tbody.addEventListener('click', handleExpandClick);
 
     function handleSelectAll() {
-        const checkboxes = container.querySelectorAll('tbody input[type="checkbox"]');
-        checkboxes.forEach(checkbox => {
-            checkbox.checked = selectAllCheckbox.checked;
-            updateSelectedFiles(checkbox);
+        // Applies to the files matching the current filters
+        viewFiles.forEach(file => {
+            if (selectAllCheckbox.checked) {
+                selectedFiles.add(file.path);
+            } else {
+                selectedFiles.delete(file.path);
+            }
         });
-        updateTokenCount();
-        notifySelectionChange();
-        updateExtensionCheckboxes();
+        updateSelectionState();
     }
 
     function handleExtensionChange(event) {
         const extension = event.target.getAttribute('data-extension');
         const isChecked = event.target.checked;
-        const checkboxes = container.querySelectorAll(`tbody input[type="checkbox"][data-extension="${extension}"]`);
-        checkboxes.forEach(checkbox => {
-            checkbox.checked = isChecked;
-            updateSelectedFiles(checkbox);
+        filesData.forEach(file => {
+            if (file._extension !== extension) return;
+            if (isChecked) {
+                selectedFiles.add(file.path);
+            } else {
+                selectedFiles.delete(file.path);
+            }
         });
-        updateTokenCount();
-        notifySelectionChange();
-        updateSelectAllCheckbox();
+        updateSelectionState();
     }
 
-    function updateSelectedFiles(checkbox) {
-        const filePath = checkbox.dataset.filePath;
+    function handleCheckboxChange(e) {
+        const checkbox = e.target;
+        if (!checkbox.dataset.filePath) return;
+        e.stopPropagation();
         if (checkbox.checked) {
-            selectedFiles.add(filePath);
+            selectedFiles.add(checkbox.dataset.filePath);
         } else {
-            selectedFiles.delete(filePath);
+            selectedFiles.delete(checkbox.dataset.filePath);
         }
+        updateSelectionState();
+    }
+
+    function handleExpandClick(e) {
+        const button = e.target.closest('.expand-button');
+        if (!button) return;
+        const filePath = button.dataset.filePath;
+        if (expandedDiffs.has(filePath)) {
+            expandedDiffs.delete(filePath);
+        } else {
+            expandedDiffs.add(filePath);
+        }
+        layout();
+        scheduleRender();
     }
 
     function notifySelectionChange() {
@@ -56,59 +116,124 @@ function FileList(containerId) {
         return Array.from(selectedFiles);
     }
 
+    // Recompute everything derived from the selection from the data, not the DOM
+    function updateSelectionState() {
+        updateTokenCount();
+        updateSelectAllCheckbox();
+        updateExtensionCheckboxes();
+        renderedRows.forEach(({ row }, filePath) => {
+            row.querySelector('input[type="checkbox"]').checked = selectedFiles.has(filePath);
+        });
+        notifySelectionChange();
+    }
+
     function updateTokenCount() {
-        const tokenSum = Array.from(container.querySelectorAll('tbody input[type="checkbox"]:checked'))
-            .reduce((sum, checkbox) => {
-                const row = checkbox.closest('tr');
-                const tokenCell = row.querySelector('td:last-child');
-                return sum + parseInt(tokenCell.textContent || 0);
-            }, 0);
-        
+        let tokenSum = 0;
+        selectedFiles.forEach(filePath => {
+            const file = filesByPath.get(filePath);
+            if (file) tokenSum += file.tokens;
+        });
         const tokenCounter = document.getElementById('tokenCount');
         tokenCounter.textContent = `(${tokenSum} tokens selected)`;
     }
 
+    function updateSelectAllCheckbox() {
+        const checkedCount = viewFiles.reduce((count, file) => count + (selectedFiles.has(file.path) ? 1 : 0), 0);
+        setTriState(selectAllCheckbox, checkedCount, viewFiles.length);
+    }
+
     function updateExtensionCheckboxes() {
+        const totals = {};
+        const checked = {};
+        filesData.forEach(file => {
+            totals[file._extension] = (totals[file._extension] || 0) + 1;
+            if (selectedFiles.has(file.path)) {
+                checked[file._extension] = (checked[file._extension] || 0) + 1;
+            }
+        });
         const extensionContainer = document.getElementById('extensionFilters');
-        const extensionCheckboxes = extensionContainer.querySelectorAll('input[type="checkbox"]');
-        
-        extensionCheckboxes.forEach(extCheckbox => {
+        extensionContainer.querySelectorAll('input[type="checkbox"]').forEach(extCheckbox => {
             const extension = extCheckbox.dataset.extension;
-            const fileCheckboxes = container.querySelectorAll(`tbody input[type="checkbox"][data-extension="${extension}"]`);
-            const checkedCount = Array.from(fileCheckboxes).filter(cb => cb.checked).length;
-            
-            if (checkedCount === 0) {
-                extCheckbox.checked = false;
-                extCheckbox.indeterminate = false;
-            } else if (checkedCount === fileCheckboxes.length) {
-                extCheckbox.checked = true;
-                extCheckbox.indeterminate = false;
-            } else {
-                extCheckbox.checked = false;
-                extCheckbox.indeterminate = true;
-            }
+            setTriState(extCheckbox, checked[extension] || 0, totals[extension] || 0);
         });
     }
 
+    function setTriState(checkbox, checkedCount, total) {
+        checkbox.checked = checkedCount > 0 && checkedCount === total;
+        checkbox.indeterminate = checkedCount > 0 && checkedCount < total;
+    }
+
     async function loadFileStructure() {
         try {
             const response = await fetch('/api/files');
-            filesData = await response.json();
-            renderFileTable();
-            renderExtensionCheckboxes();
+            const etag = response.headers.get('ETag');
+            // The browser revalidates with If-None-Match; an unchanged tag means nothing to merge
+            if (etag && etag === filesEtag) return;
+            const files = await response.json();
+            if (!response.ok) {
+                throw new Error(files.message || response.statusText);
+            }
+            filesEtag = etag;
+            mergeFiles(files);
         } catch (error) {
-            container.querySelector('tbody').innerHTML = 
-                `<tr><td colspan="6" class="error">Error loading files: ${error.message}</td></tr>`;
+            filesEtag = null;
+            renderedRows = new Map();
+            tbody.innerHTML =
+                `<tr><td colspan="${COLUMN_COUNT}" class="error">Error loading files: ${escapeHtml(error.message)}</td></tr>`;
         }
     }
 
-    function renderExtensionCheckboxes() {
-        const extensionContainer = document.getElementById('extensionFilters');
-        extensionContainer.innerHTML = 'Select by extension: '; // Clear existing checkboxes and add label
+    function fileSignature(file) {
+        return [file.size, file.mtime, file.tokens, file.tokens_estimated, file.git_status, file.diff ? file.diff.length : 0].join('|');
+    }
+
+    // Merge a fresh /api/files listing: only added, removed or changed entries are touched
+    function mergeFiles(files) {
+        let changed = false;
+        const seen = new Set();
+        files.forEach(file => {
+            seen.add(file.path);
+            const signature = fileSignature(file);
+            const existing = filesByPath.get(file.path);
+            if (existing && existing._signature === signature) return;
+            file._signature = signature;
+            file._pathLower = file.path.toLowerCase();
+            file._extension = getFileExtension(file.path);
+            file._statusRank = STATUS_ORDER[file.git_status] ?? 5;
+            filesByPath.set(file.path, file);
+            changed = true;
+        });
+        let selectionChanged = false;
+        Array.from(filesByPath.keys()).forEach(filePath => {
+            if (seen.has(filePath)) return;
+            filesByPath.delete(filePath);
+            expandedDiffs.delete(filePath);
+            selectionChanged = selectedFiles.delete(filePath) || selectionChanged;
+            changed = true;
+        });
+        if (!changed) return;
 
-        const uniqueExtensions = [...new Set(filesData.map(file => getFileExtension(file.path)))]
+        filesData = Array.from(filesByPath.values());
+        sortIndex = {};
+        viewFilter = null;
+        renderExtensionCheckboxes();
+        applyFilters();
+        updateTokenCount();
+        updateSelectAllCheckbox();
+        updateExtensionCheckboxes();
+        if (selectionChanged) notifySelectionChange();
+    }
+
+    function renderExtensionCheckboxes() {
+        const uniqueExtensions = [...new Set(filesData.map(file => file._extension))]
             .filter(ext => ext.length <= 4)
             .sort();
+        // Keep the existing checkboxes when the set of extensions did not change
+        if (uniqueExtensions.join('/') === extensionList) return;
+        extensionList = uniqueExtensions.join('/');
+
+        const extensionContainer = document.getElementById('extensionFilters');
+        extensionContainer.innerHTML = 'Select by extension: '; // Clear existing checkboxes and add label
         uniqueExtensions.forEach(ext => {
             const label = document.createElement('label');
             const checkbox = document.createElement('input');
@@ -123,43 +248,190 @@ function FileList(containerId) {
         });
     }
 
-    function sortFiles(files) {
-        return files.slice().sort((a, b) => {
-            let valA = a[currentSortKey];
-            let valB = b[currentSortKey];
-            if (typeof valA === 'string') valA = valA.toLowerCase();
-            if (typeof valB === 'string') valB = valB.toLowerCase();
-            if (valA < valB) return currentSortOrder === 'asc' ? -1 : 1;
-            if (valA > valB) return currentSortOrder === 'asc' ? 1 : -1;
-            return 0;
+    function compareFiles(key) {
+        return (a, b) => {
+            let valA, valB;
+            if (key === 'path') {
+                valA = a._pathLower;
+                valB = b._pathLower;
+            } else if (key === 'git_status') {
+                valA = a._statusRank;
+                valB = b._statusRank;
+            } else {
+                valA = a[key];
+                valB = b[key];
+            }
+            if (valA < valB) return -1;
+            if (valA > valB) return 1;
+            // Ties keep a stable order by path
+            return a._pathLower < b._pathLower ? -1 : (a._pathLower > b._pathLower ? 1 : 0);
+        };
+    }
+
+    function sortedFiles() {
+        let ascending = sortIndex[currentSortKey];
+        if (!ascending) {
+            ascending = filesData.slice().sort(compareFiles(currentSortKey));
+            sortIndex[currentSortKey] = ascending;
+        }
+        return currentSortOrder === 'asc' ? ascending : ascending.slice().reverse();
+    }
+
+    function matchesFilter(file, terms, status) {
+        if (status === 'changed' ? file.git_status === 'unmodified' : (status !== 'all' && file.git_status !== status)) {
+            return false;
+        }
+        return terms.every(term => file._pathLower.includes(term));
+    }
+
+    function scheduleFilter() {
+        if (filterScheduled) return;
+        filterScheduled = true;
+        requestAnimationFrame(() => {
+            filterScheduled = false;
+            applyFilters();
+            updateSelectAllCheckbox();
+        });
+    }
+
+    function applyFilters() {
+        const text = filterInput.value.trim().toLowerCase();
+        const status = statusFilter.value;
+        const terms = text.split(/\s+/).filter(Boolean);
+        // Typing more of the same query can only narrow the result, so filter the
+        // previous matches (already in display order) instead of every file
+        const narrowing = viewFilter !== null && viewFilter.status === status && text.includes(viewFilter.text);
+        const candidates = narrowing ? viewFiles : sortedFiles();
+        viewFiles = (terms.length || status !== 'all')
+            ? candidates.filter(file => matchesFilter(file, terms, status))
+            : candidates;
+        viewFilter = { text, status };
+        fileCount.textContent = viewFiles.length === filesData.length
+            ? `${filesData.length} files`
+            : `${viewFiles.length} of ${filesData.length} files`;
+        layout();
+        scheduleRender();
+    }
+
+    function layout() {
+        layoutItems = [];
+        layoutOffsets = [];
+        let top = 0;
+        viewFiles.forEach(file => {
+            layoutItems.push({ file, isDiff: false });
+            layoutOffsets.push(top);
+            top += rowHeight;
+            if (file.diff && expandedDiffs.has(file.path)) {
+                layoutItems.push({ file, isDiff: true });
+                layoutOffsets.push(top);
+                top += diffRowHeight;
+            }
         });
+        totalHeight = top;
     }
 
-    function renderFileTable() {
-        const tbody = container.querySelector('tbody');
-        tbody.innerHTML = '';
-        const sortedFiles = sortFiles(filesData);
-        sortedFiles.forEach(file => renderFileRow(file, tbody));
+    // Index of the layout item covering the given offset
+    function findItem(offset) {
+        let low = 0;
+        let high = layoutOffsets.length - 1;
+        while (low < high) {
+            const mid = (low + high + 1) >> 1;
+            if (layoutOffsets[mid] <= offset) {
+                low = mid;
+            } else {
+                high = mid - 1;
+            }
+        }
+        return low;
+    }
+
+    function scheduleRender() {
+        if (renderScheduled) return;
+        renderScheduled = true;
+        requestAnimationFrame(renderVisibleRows);
     }
 
-    function renderFileRow(file, tbody) {
+    function createSpacerRow(height) {
+        const row = document.createElement('tr');
+        row.className = 'spacer-row';
+        const cell = document.createElement('td');
+        cell.colSpan = COLUMN_COUNT;
+        cell.style.height = `${height}px`;
+        row.appendChild(cell);
+        return row;
+    }
+
+    // Put only the rows in (and just around) the viewport into the DOM
+    function renderVisibleRows() {
+        renderScheduled = false;
+        if (layoutItems.length === 0) {
+            renderedRows = new Map();
+            tbody.innerHTML = filesData.length
+                ? `<tr><td colspan="${COLUMN_COUNT}" class="empty">No files match the filter</td></tr>`
+                : '';
+            return;
+        }
+
+        // Offsets are relative to the top of tbody, below the sticky header
+        const bodyTop = tbody.offsetTop;
+        const viewTop = Math.max(0, scroller.scrollTop - bodyTop);
+        const viewBottom = viewTop + scroller.clientHeight;
+        const first = Math.max(0, findItem(viewTop) - OVERSCAN_ROWS);
+        const last = Math.min(layoutItems.length - 1, findItem(viewBottom) + OVERSCAN_ROWS);
+
+        const previousRows = renderedRows;
+        renderedRows = new Map();
+        const rows = [createSpacerRow(layoutOffsets[first])];
+        let measuredRow = null;
+        let measuredDiffRow = null;
+        for (let i = first; i <= last; i++) {
+            const { file, isDiff } = layoutItems[i];
+            let cached = renderedRows.get(file.path) || previousRows.get(file.path);
+            if (!cached || cached.signature !== file._signature) {
+                cached = { signature: file._signature, row: createFileRow(file), diffRow: null };
+            }
+            renderedRows.set(file.path, cached);
+            if (isDiff) {
+                cached.diffRow = cached.diffRow || createDiffRow(file.diff);
+                rows.push(cached.diffRow);
+                measuredDiffRow = measuredDiffRow || cached.diffRow;
+            } else {
+                const expandButton = cached.row.querySelector('.expand-button');
+                if (expandButton) {
+                    expandButton.innerHTML = expandedDiffs.has(file.path) ? '▼' : '▶';
+                }
+                cached.row.querySelector('input[type="checkbox"]').checked = selectedFiles.has(file.path);
+                rows.push(cached.row);
+                measuredRow = measuredRow || cached.row;
+            }
+        }
+        const renderedBottom = layoutOffsets[last] + (layoutItems[last].isDiff ? diffRowHeight : rowHeight);
+        rows.push(createSpacerRow(totalHeight - renderedBottom));
+        tbody.replaceChildren(...rows);
+
+        // Re-layout if the real row heights differ from the ones assumed
+        const actualRowHeight = measuredRow ? measuredRow.getBoundingClientRect().height : rowHeight;
+        const actualDiffRowHeight = measuredDiffRow ? measuredDiffRow.getBoundingClientRect().height : diffRowHeight;
+        if (Math.abs(actualRowHeight - rowHeight) > 0.1 || Math.abs(actualDiffRowHeight - diffRowHeight) > 0.1) {
+            rowHeight = actualRowHeight;
+            diffRowHeight = actualDiffRowHeight;
+            layout();
+            scheduleRender();
+        }
+    }
+
+    function createFileRow(file) {
         const row = document.createElement('tr');
         row.className = 'file-row';
-        
+
         row.appendChild(createCheckboxCell(file));
-        row.appendChild(createExpandButtonCell(file, row));
+        row.appendChild(createExpandButtonCell(file));
         row.appendChild(createFileNameCell(file));
+        row.appendChild(createStatusCell(file));
         row.appendChild(createCell(getRelativeTime(file.mtime)));
         row.appendChild(createCell(`${file.size} bytes`));
-        row.appendChild(createCell(file.tokens.toString()));
-        
-        tbody.appendChild(row);
-
-        if (file.diff) {
-            const diffRow = createDiffRow(file.diff);
-            diffRow.style.display = 'none';
-            tbody.appendChild(diffRow);
-        }
+        row.appendChild(createCell(file.tokens_estimated ? `~${file.tokens}` : file.tokens.toString()));
+        return row;
     }
 
     function getRelativeTime(unixTimestamp) {
@@ -190,8 +462,7 @@ function FileList(containerId) {
         checkbox.type = 'checkbox';
         checkbox.checked = selectedFiles.has(file.path);
         checkbox.dataset.filePath = file.path;
-        checkbox.dataset.extension = getFileExtension(file.path);
-        checkbox.addEventListener('change', handleCheckboxChange);
+        checkbox.dataset.extension = file._extension;
         cell.appendChild(checkbox);
         return cell;
     }
@@ -200,38 +471,13 @@ function FileList(containerId) {
         return filePath.split('.').pop().toLowerCase();
     }
 
-    function handleCheckboxChange(e) {
-        e.stopPropagation();
-        updateSelectedFiles(e.target);
-        updateTokenCount();
-        notifySelectionChange();
-        updateSelectAllCheckbox();
-        updateExtensionCheckboxes();
-    }
-
-    function updateSelectAllCheckbox() {
-        const totalCheckboxes = container.querySelectorAll('tbody input[type="checkbox"]').length;
-        const checkedCheckboxes = container.querySelectorAll('tbody input[type="checkbox"]:checked').length;
-        
-        if (checkedCheckboxes === 0) {
-            selectAllCheckbox.checked = false;
-            selectAllCheckbox.indeterminate = false;
-        } else if (checkedCheckboxes === totalCheckboxes) {
-            selectAllCheckbox.checked = true;
-            selectAllCheckbox.indeterminate = false;
-        } else {
-            selectAllCheckbox.checked = false;
-            selectAllCheckbox.indeterminate = true;
-        }
-    }
-
-    function createExpandButtonCell(file, row) {
+    function createExpandButtonCell(file) {
         const cell = document.createElement('td');
         if (file.diff) {
             const button = document.createElement('button');
             button.className = 'expand-button';
-            button.innerHTML = '\u25b6';
-            button.addEventListener('click', () => toggleDiff(file.path, row));
+            button.dataset.filePath = file.path;
+            button.innerHTML = '▶';
             cell.appendChild(button);
         }
         return cell;
@@ -239,7 +485,13 @@ function FileList(containerId) {
 
     function createFileNameCell(file) {
         const cell = document.createElement('td');
-        cell.innerHTML = file.path;
+        cell.textContent = file.path;
+        cell.title = file.path;
+        return cell;
+    }
+
+    function createStatusCell(file) {
+        const cell = document.createElement('td');
         if (file.git_status !== 'unmodified') {
             const badge = document.createElement('span');
             badge.className = `status-badge status-${file.git_status}`;
@@ -259,9 +511,9 @@ function FileList(containerId) {
         const row = document.createElement('tr');
         row.className = 'diff-row';
         const cell = document.createElement('td');
-        cell.colSpan = 6;
+        cell.colSpan = COLUMN_COUNT;
         const content = document.createElement('div');
-        content.className = 'diff-view';
+        content.className = 'diff-view expanded';
         content.innerHTML = formatDiff(diff);
         cell.appendChild(content);
         row.appendChild(cell);
@@ -270,10 +522,10 @@ function FileList(containerId) {
 
     function formatDiff(diff) {
         if (!diff) return '';
-        
+
         const lines = diff.split('\n');
         let html = '<div class="diff-content">';
-        
+
         lines.forEach((line, index) => {
             let className = 'diff-line';
             if (line.startsWith('+')) {
@@ -283,14 +535,14 @@ function FileList(containerId) {
             } else if (line.startsWith('@')) {
                 className += ' info';
             }
-            
+
             html += `
                 <div class="${className}">
                     <span class="diff-line-number">${index + 1}</span>
                     <span class="diff-line-content">${escapeHtml(line)}</span>
                 </div>`;
         });
-        
+
         html += '</div>';
         return html;
     }
@@ -304,25 +556,13 @@ function FileList(containerId) {
             .replace(/'/g, "&#039;");
     }
 
-    function toggleDiff(filePath, row) {
-        const diffRow = row.nextElementSibling;
-        if (diffRow && diffRow.classList.contains('diff-row')) {
-            const diffView = diffRow.querySelector('.diff-view');
-            const expandButton = row.querySelector('.expand-button');
-            
-            if (diffView.classList.contains('expanded')) {
-                diffView.classList.remove('expanded');
-                expandButton.innerHTML = '\u25b6';
-                diffRow.style.display = 'none';
-            } else {
-                diffView.classList.add('expanded');
-                expandButton.innerHTML = '\u25bc';
-                diffRow.style.display = 'table-row';
-            }
-        }
-    }
-
     const headerCells = container.querySelectorAll('thead th.sortable');
+    function updateSortIndicators() {
+        headerCells.forEach(header => {
+            header.classList.toggle('sorted-asc', header.dataset.sortKey === currentSortKey && currentSortOrder === 'asc');
+            header.classList.toggle('sorted-desc', header.dataset.sortKey === currentSortKey && currentSortOrder === 'desc');
+        });
+    }
     headerCells.forEach(header => {
         header.addEventListener('click', () => {
             const sortKey = header.dataset.sortKey;
@@ -332,9 +572,12 @@ function FileList(containerId) {
                 currentSortKey = sortKey;
                 currentSortOrder = 'asc';
             }
-            renderFileTable();
+            updateSortIndicators();
+            viewFilter = null;
+            applyFilters();
         });
     });
+    updateSortIndicators();
 
     return {
         load: loadFileStructure,
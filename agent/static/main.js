@@ -3,6 +3,8 @@ const fileList = new FileList('fileList');
 
 // State management
 let isProcessing = false;
+// How often the file list is checked for changes made outside GitIQ
+const FILE_LIST_REFRESH_MS = 10000;
 
 // DOM elements
 const repoStatus = document.getElementById('repoStatus');
@@ -304,6 +306,10 @@ async function initialize() {
     }
     updateBranchSelectState();
     addLogEntry('GitIQ initialized successfully', 'info');
+    // Unchanged listings are answered with 304 and leave the list untouched
+    setInterval(() => {
+        if (!document.hidden && !isProcessing) fileList.load();
+    }, FILE_LIST_REFRESH_MS);
 }
 
 initialize();
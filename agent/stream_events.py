@@ -1,31 +1,71 @@
 """
 stream_events.py - Simple event streaming with timing and LLM stats
 """
-from typing import Dict, Any
-from queue import Queue, Empty
+from typing import Dict, Any, Iterator
+from queue import Queue, Empty, Full
 from contextlib import contextmanager
 import time
 import logging
 import json
+import threading
+from flask import Response
+from config import get_config
 from llm_integration import chat_completion
+from tracing import span, current_trace_id
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_SERVING_CONFIG = {
+    # Concurrent streaming jobs per process; further requests get 503
+    "max_streams": 64,
+    # Seconds without events before an SSE comment is sent to keep proxies from timing out
+    "heartbeat_interval": 15,
+    # Events buffered per stream before the job waits for a slow client
+    "max_buffered_events": 100,
+    # Seconds to wait for running jobs on shutdown
+    "drain_timeout": 300
+}
+
+# Active streaming jobs, guarded by _streams_lock
+_active_streams = 0
+_draining = False
+_streams_lock = threading.Condition()
+
+def _sum_usage(calls: list) -> Dict[str, float]:
+    """Add up the numeric usage fields of LLM calls"""
+    stats = {"total_tokens": 0}
+    for usage in calls:
+        for key, value in usage.items():
+            if isinstance(value, (int, float)):
+                stats[key] = stats.get(key, 0) + value
+    return stats
+
 class StreamProcessor:
     def __init__(self):
         self.stats_queue = Queue()
         self.timings: Dict[str, float] = {}
         self._stage_times: Dict[str, float] = {}
+        # Open stages, innermost last
+        self._stages: list[str] = []
+        # Usage of every LLM call, tagged with the stage it was made in
+        self.llm_calls: list[Dict[str, Any]] = []
+        self._unreported_calls: list[Dict[str, Any]] = []
 
     @contextmanager
     def stage(self, name: str):
-        """Time a processing stage using a context manager"""
-        try:
-            self._stage_times[name] = time.time()
-            yield
-        finally:
-            if name in self._stage_times:
-                self.timings[name] = (time.time() - self._stage_times[name]) * 1000
+        """Time a processing stage and record it as a trace span"""
+        with span(name):
+            self._stages.append(name)
+            try:
+                self._stage_times[name] = time.time()
+                yield
+            finally:
+                # Calls are made synchronously inside the stage, so whatever
+                # usage is queued now belongs to it
+                self._collect_stats()
+                self._stages.pop()
+                if name in self._stage_times:
+                    self.timings[name] = (time.time() - self._stage_times[name]) * 1000
 
     def chat(self, messages: list[dict], model_name: str, **kwargs) -> str:
         """Execute chat completion with automatic stats collection"""
@@ -36,30 +76,138 @@ class StreamProcessor:
             **kwargs
         )
 
-    def event(self, stage: str, data: Dict[str, Any]) -> str:
-        """Create a stream event with timing and any available LLM stats"""
-        event_data = {"stage": stage, **data}
-        
-        if stage in self.timings:
-            event_data["timing"] = self.timings[stage]
-
-        # Collect stats without blocking
-        stats = {"total_tokens": 0}
+    def _collect_stats(self) -> None:
+        """Move queued LLM usage into llm_calls, tagged with the current stage"""
         while True:
             try:
                 usage = self.stats_queue.get_nowait()
-                for key, value in usage.items():
-                    if isinstance(value, (int, float)):
-                        stats[key] = stats.get(key, 0) + value
             except Empty:
                 break
+            call = {**usage, "stage": self._stages[-1] if self._stages else None}
+            self.llm_calls.append(call)
+            self._unreported_calls.append(call)
+
+    def stats_by_stage(self) -> Dict[str, Dict[str, float]]:
+        """Summed LLM usage per stage"""
+        stages = {}
+        for call in self.llm_calls:
+            stages.setdefault(call['stage'], []).append(call)
+        return {stage: _sum_usage(calls) for stage, calls in stages.items()}
+
+    def event(self, stage: str, data: Dict[str, Any]) -> str:
+        """Create a stream event with timing and the LLM calls made since the last event"""
+        event_data = {"stage": stage, **data}
         
-        if stats["total_tokens"] > 0:
-            event_data["llm_stats"] = stats
+        if stage in self.timings:
+            event_data["timing"] = self.timings[stage]
+
+        self._collect_stats()
+        if self._unreported_calls:
+            event_data["llm_stats"] = _sum_usage(self._unreported_calls)
+            event_data["llm_calls"] = self._unreported_calls
+            self._unreported_calls = []
 
         if stage in ("complete", "error"):
             event_data["timings"] = self.timings
+            event_data["llm_stats_by_stage"] = self.stats_by_stage()
+            event_data["trace_id"] = current_trace_id()
 
         output = f"data: {json.dumps(event_data)}\n\n"
         logger.info(f"streaming: {output}")
         return output
+
+
+def get_serving_config() -> dict:
+    """Return streaming/serving settings from the "serving" section of config.json."""
+    return {**DEFAULT_SERVING_CONFIG, **get_config().get('serving', {})}
+
+def try_begin_stream() -> bool:
+    """Reserve a streaming job slot; False if at max_streams or draining."""
+    global _active_streams
+    with _streams_lock:
+        if _draining or _active_streams >= get_serving_config()['max_streams']:
+            return False
+        _active_streams += 1
+        return True
+
+def end_stream() -> None:
+    """Release a slot reserved by try_begin_stream."""
+    global _active_streams
+    with _streams_lock:
+        _active_streams -= 1
+        _streams_lock.notify_all()
+
+def active_streams() -> int:
+    return _active_streams
+
+def begin_drain() -> None:
+    """Stop accepting new streaming jobs; running jobs continue."""
+    global _draining
+    with _streams_lock:
+        _draining = True
+    logger.info(f"Draining: waiting for {_active_streams} streaming job(s)")
+
+def wait_for_drain(timeout: float) -> bool:
+    """Wait until all streaming jobs have finished; False if the timeout expired."""
+    deadline = time.time() + timeout
+    with _streams_lock:
+        while _active_streams > 0:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                logger.warning(f"Drain timeout with {_active_streams} streaming job(s) still running")
+                return False
+            _streams_lock.wait(remaining)
+    return True
+
+def event_stream_response(events: Iterator[str]) -> Response:
+    """
+    Run an event generator in its own thread and stream its events as SSE.
+
+    The caller must have reserved a slot with try_begin_stream(); it is released
+    when the job finishes. While the job is busy (e.g. waiting on the LLM), an
+    SSE comment is sent every heartbeat_interval seconds. At most
+    max_buffered_events are queued: a slow client makes the job wait rather than
+    buffering without bound. If the client disconnects, the job still runs to
+    completion so the repository is left in a consistent state; its remaining
+    events are discarded.
+    """
+    serving_config = get_serving_config()
+    buffer = Queue(maxsize=serving_config['max_buffered_events'])
+    disconnected = threading.Event()
+    done = object()
+
+    def put(item):
+        while not disconnected.is_set():
+            try:
+                buffer.put(item, timeout=1)
+                return
+            except Full:
+                continue
+
+    def produce():
+        try:
+            for event in events:
+                put(event)
+        except Exception:
+            logger.exception("Error in streaming job")
+        finally:
+            put(done)
+            end_stream()
+
+    def relay():
+        while True:
+            try:
+                item = buffer.get(timeout=serving_config['heartbeat_interval'])
+            except Empty:
+                yield ": heartbeat\n\n"
+                continue
+            if item is done:
+                break
+            yield item
+
+    threading.Thread(target=produce, name="stream-job", daemon=True).start()
+    response = Response(relay(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(disconnected.set)
+    return response
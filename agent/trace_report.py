@@ -0,0 +1,156 @@
+"""trace_report.py - Break down a job trace, or run a stand-in OTLP collector
+
+    python agent/trace_report.py [trace_id]       # latest trace if no id is given
+    python agent/trace_report.py --list           # recent traces, slowest first
+    python agent/trace_report.py --collect [port] # receive OTLP/HTTP JSON on :4318
+
+Reads the JSONL file written by the "jsonl" tracing exporter (tracing.path in
+config.json). The collector accepts what the "otlp" exporter posts to
+/v1/traces and appends the spans to the same file, so the report works for
+either exporter. Run from the directory containing config.json.
+"""
+import os
+import sys
+import json
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, AGENT_DIR)
+
+from config import set_config_path, state_path  # noqa: E402
+from tracing import get_tracing_config  # noqa: E402
+
+# Span attributes shown next to each span in the tree
+SHOWN_ATTRIBUTES = ("model", "prompt_tokens", "completion_tokens", "cost", "ttft_ms", "queue_wait_ms", "argv", "pr", "job", "files")
+
+def traces_path() -> str:
+    set_config_path('config.json')
+    return state_path(get_tracing_config()['path'])
+
+def load_spans(path: str) -> dict:
+    """Return {trace_id: [span dicts]} from a traces JSONL file"""
+    traces = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                span_data = json.loads(line)
+                traces[span_data['trace_id']].append(span_data)
+    return traces
+
+def _root(spans):
+    ids = {s['span_id'] for s in spans}
+    roots = [s for s in spans if s['parent_id'] not in ids]
+    return min(roots, key=lambda s: s['start'])
+
+def list_traces(traces: dict) -> None:
+    rows = sorted(((_root(spans), len(spans)) for spans in traces.values()),
+                  key=lambda row: row[0]['duration_ms'], reverse=True)
+    for root, count in rows[:50]:
+        print(f"{root['trace_id']}  {root['duration_ms']:>10.1f} ms  {count:>4} spans  {root['name']}  {root['status']}")
+
+def print_trace(spans: list) -> None:
+    children = defaultdict(list)
+    for span_data in spans:
+        children[span_data['parent_id']].append(span_data)
+    root = _root(spans)
+    origin = root['start']
+
+    def show(span_data, depth):
+        attributes = span_data['attributes']
+        details = " ".join(
+            f"{key}={attributes[key]:.1f}" if isinstance(attributes[key], float) else f"{key}={attributes[key]}"
+            for key in SHOWN_ATTRIBUTES if attributes.get(key) is not None
+        )
+        status = "" if span_data['status'] == "ok" else f" [{span_data['status']}: {(span_data['error'] or '')[:100]}]"
+        print(f"{(span_data['start'] - origin) * 1000:>9.1f} {span_data['duration_ms']:>9.1f} ms  "
+              f"{'  ' * depth}{span_data['name']}  {details}{status}")
+        for child in sorted(children[span_data['span_id']], key=lambda s: s['start']):
+            show(child, depth + 1)
+
+    print(f"trace {root['trace_id']}\n{'start':>9} {'duration':>12}")
+    show(root, 0)
+
+    # Time by kind of work; nested spans of the same kind are not double counted
+    totals = defaultdict(float)
+    by_id = {s['span_id']: s for s in spans}
+    for span_data in spans:
+        kind = span_data['name'].split('.')[0].split(' ')[0]
+        parent = by_id.get(span_data['parent_id'])
+        if parent is None or parent['name'].split('.')[0].split(' ')[0] != kind:
+            totals[kind] += span_data['duration_ms']
+    print("\ntotal by kind:")
+    for kind, duration in sorted(totals.items(), key=lambda item: -item[1]):
+        print(f"  {kind:<24} {duration:>9.1f} ms")
+
+def _attribute_value(value: dict):
+    if 'intValue' in value:
+        return int(value['intValue'])
+    if 'doubleValue' in value:
+        return value['doubleValue']
+    if 'boolValue' in value:
+        return value['boolValue']
+    return value.get('stringValue')
+
+def collect(port: int, path: str) -> None:
+    """Stand-in for an OTLP/HTTP collector: store received spans in the JSONL file"""
+
+    class CollectorHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            received = 0
+            with open(path, 'a') as f:
+                for resource_spans in body.get('resourceSpans', []):
+                    for scope_spans in resource_spans.get('scopeSpans', []):
+                        for otlp_span in scope_spans.get('spans', []):
+                            start = int(otlp_span['startTimeUnixNano']) / 1e9
+                            end = int(otlp_span['endTimeUnixNano']) / 1e9
+                            status = otlp_span.get('status', {})
+                            f.write(json.dumps({
+                                "trace_id": otlp_span['traceId'],
+                                "span_id": otlp_span['spanId'],
+                                "parent_id": otlp_span.get('parentSpanId') or None,
+                                "name": otlp_span['name'],
+                                "start": start,
+                                "end": end,
+                                "duration_ms": (end - start) * 1000,
+                                "status": "error" if status.get('code') == 2 else "ok",
+                                "error": status.get('message'),
+                                "attributes": {a['key']: _attribute_value(a['value']) for a in otlp_span.get('attributes', [])}
+                            }) + "\n")
+                            received += 1
+            print(f"received {received} spans")
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, *args):
+            pass
+
+    print(f"Collecting OTLP/HTTP JSON traces on http://localhost:{port}/v1/traces into {path}")
+    ThreadingHTTPServer(('127.0.0.1', port), CollectorHandler).serve_forever()
+
+def main():
+    path = traces_path()
+    if len(sys.argv) > 1 and sys.argv[1] == '--collect':
+        collect(int(sys.argv[2]) if len(sys.argv) > 2 else 4318, path)
+        return
+    if not os.path.exists(path):
+        sys.exit(f"No traces at {path}")
+    traces = load_spans(path)
+    if not traces:
+        sys.exit("No traces recorded yet")
+    if len(sys.argv) > 1 and sys.argv[1] == '--list':
+        list_traces(traces)
+        return
+    if len(sys.argv) > 1:
+        if sys.argv[1] not in traces:
+            sys.exit(f"Unknown trace {sys.argv[1]}")
+        print_trace(traces[sys.argv[1]])
+    else:
+        latest = max(traces.values(), key=lambda spans: _root(spans)['start'])
+        print_trace(latest)
+
+if __name__ == '__main__':
+    main()
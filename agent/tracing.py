@@ -0,0 +1,230 @@
+"""tracing.py - Per-job trace spans exported to a JSONL file or an OTLP/HTTP collector"""
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from queue import Queue, Full
+from contextlib import contextmanager
+
+from config import get_config, state_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRACING_CONFIG = {
+    "enabled": True,
+    # "jsonl" appends one span per line to "path"; "otlp" posts OTLP/HTTP JSON to "endpoint"
+    "exporter": "jsonl",
+    # Relative paths are resolved from the state directory ($XDG_STATE_HOME/gitiq or ~/.gitiq)
+    "path": "gitiq_traces.jsonl",
+    # The file is moved to <path>.1 once it grows past this size
+    "max_file_bytes": 50 * 1024 * 1024,
+    "endpoint": "http://localhost:4318/v1/traces",
+    "timeout": 5
+}
+
+# Finished traces waiting for the exporter thread; traces are dropped when it is full
+EXPORT_QUEUE_SIZE = 1000
+
+# The span the current thread (or greenlet) is inside
+_current_span = contextvars.ContextVar('gitiq_current_span', default=None)
+
+# trace id -> finished spans of traces whose root span is still open
+_open_traces = {}
+_open_traces_lock = threading.Lock()
+
+_export_queue = Queue(maxsize=EXPORT_QUEUE_SIZE)
+_exporter_thread = None
+_exporter_lock = threading.Lock()
+
+def get_tracing_config() -> dict:
+    """Return tracing settings from the "tracing" section of config.json."""
+    return {**DEFAULT_TRACING_CONFIG, **get_config().get('tracing', {})}
+
+def current_span():
+    """Return the innermost open span dict, or None outside any span"""
+    return _current_span.get()
+
+def current_trace_id():
+    span_data = _current_span.get()
+    return span_data['trace_id'] if span_data else None
+
+def set_attributes(**attributes) -> None:
+    """Add attributes to the innermost open span (no-op outside any span)"""
+    span_data = _current_span.get()
+    if span_data is not None:
+        span_data['attributes'].update(attributes)
+
+def record_error(error) -> None:
+    """Mark the innermost open span as failed by an exception that was handled"""
+    span_data = _current_span.get()
+    if span_data is not None:
+        span_data['status'] = "error"
+        span_data['error'] = f"{type(error).__name__}: {str(error)}"
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Record a span around the block and yield its dict.
+
+    The span is a child of the innermost open span in this context, or the
+    root of a new trace. A trace is exported when its root span ends; spans
+    that end after their root are exported on their own. Exceptions mark the
+    span as failed and are re-raised.
+    """
+    parent = _current_span.get()
+    span_data = {
+        "trace_id": parent['trace_id'] if parent else uuid.uuid4().hex,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent['span_id'] if parent else None,
+        "name": name,
+        "start": time.time(),
+        "end": None,
+        "duration_ms": None,
+        "status": "ok",
+        "error": None,
+        "attributes": dict(attributes)
+    }
+    if parent is None:
+        with _open_traces_lock:
+            _open_traces[span_data['trace_id']] = []
+    token = _current_span.set(span_data)
+    start = time.perf_counter()
+    try:
+        yield span_data
+    except GeneratorExit:
+        span_data['status'] = "cancelled"
+        raise
+    except BaseException as e:
+        span_data['status'] = "error"
+        span_data['error'] = f"{type(e).__name__}: {str(e)}"
+        raise
+    finally:
+        span_data['duration_ms'] = (time.perf_counter() - start) * 1000
+        span_data['end'] = span_data['start'] + span_data['duration_ms'] / 1000
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Closed from another context (e.g. a generator finalized elsewhere)
+            _current_span.set(parent)
+        _finish(span_data, is_root=parent is None)
+
+@contextmanager
+def child_span(name: str, **attributes):
+    """Like span(), but only recorded inside an open trace; yields None otherwise"""
+    if _current_span.get() is None:
+        yield None
+        return
+    with span(name, **attributes) as span_data:
+        yield span_data
+
+def propagate(fn):
+    """Wrap fn so it runs inside the caller's current span when called from another thread"""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+def _finish(span_data, is_root):
+    with _open_traces_lock:
+        if is_root:
+            spans = _open_traces.pop(span_data['trace_id'], []) + [span_data]
+        elif span_data['trace_id'] in _open_traces:
+            _open_traces[span_data['trace_id']].append(span_data)
+            return
+        else:
+            spans = [span_data]
+    tracing_config = get_tracing_config()
+    if not tracing_config['enabled']:
+        return
+    _start_exporter()
+    try:
+        _export_queue.put_nowait((spans, tracing_config))
+    except Full:
+        logger.warning(f"Trace export queue full, dropping trace {span_data['trace_id']}")
+
+def _start_exporter():
+    global _exporter_thread
+    with _exporter_lock:
+        if _exporter_thread is None or not _exporter_thread.is_alive():
+            _exporter_thread = threading.Thread(target=_export_loop, name="trace-exporter", daemon=True)
+            _exporter_thread.start()
+
+def _export_loop():
+    while True:
+        spans, tracing_config = _export_queue.get()
+        try:
+            if tracing_config['exporter'] == 'otlp':
+                _export_otlp(spans, tracing_config)
+            else:
+                _export_jsonl(spans, tracing_config)
+        except Exception as e:
+            logger.error(f"Failed to export trace {spans[0]['trace_id']}: {str(e)}")
+        finally:
+            _export_queue.task_done()
+
+def flush(timeout: float = 5.0) -> bool:
+    """Wait until queued traces are exported; returns False on timeout"""
+    deadline = time.time() + timeout
+    while _export_queue.unfinished_tasks:
+        if time.time() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def _export_jsonl(spans, tracing_config):
+    path = state_path(tracing_config['path'])
+    try:
+        if os.path.getsize(path) > tracing_config['max_file_bytes']:
+            os.replace(path, path + ".1")
+    except OSError:
+        pass
+    with open(path, 'a') as f:
+        for span_data in spans:
+            f.write(json.dumps(span_data, default=str) + "\n")
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_otlp_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+def otlp_payload(spans) -> dict:
+    """Convert span dicts to an OTLP/HTTP JSON ExportTraceServiceRequest"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "gitiq"}}]},
+            "scopeSpans": [{
+                "scope": {"name": "gitiq"},
+                "spans": [
+                    {
+                        "traceId": span_data['trace_id'],
+                        "spanId": span_data['span_id'],
+                        "parentSpanId": span_data['parent_id'] or "",
+                        "name": span_data['name'],
+                        "kind": 1,
+                        "startTimeUnixNano": str(int(span_data['start'] * 1e9)),
+                        "endTimeUnixNano": str(int(span_data['end'] * 1e9)),
+                        "attributes": [
+                            {"key": key, "value": _otlp_value(value)}
+                            for key, value in span_data['attributes'].items() if value is not None
+                        ],
+                        # OTLP status codes: 1 = OK, 2 = ERROR
+                        "status": {"code": 1} if span_data['status'] == "ok"
+                        else {"code": 2, "message": span_data['error'] or span_data['status']}
+                    }
+                    for span_data in spans
+                ]
+            }]
+        }]
+    }
+
+def _export_otlp(spans, tracing_config):
+    import requests
+    response = requests.post(tracing_config['endpoint'], json=otlp_payload(spans), timeout=tracing_config['timeout'])
+    response.raise_for_status()
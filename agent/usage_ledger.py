@@ -0,0 +1,212 @@
+"""usage_ledger.py - Local SQLite ledger of LLM calls with latency/cost statistics"""
+import time
+import sqlite3
+import logging
+import threading
+
+from config import get_config, state_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEDGER_CONFIG = {
+    "enabled": True,
+    # Relative paths are resolved from the state directory ($XDG_STATE_HOME/gitiq or ~/.gitiq)
+    "path": "gitiq_ledger.sqlite3"
+}
+
+DEFAULT_SELECTION_CONFIG = {
+    # Only the most recent calls per model are considered
+    "window": 200,
+    # Models with fewer recent calls than this are not ranked
+    "min_calls": 5,
+    # Models failing more often than this are never picked
+    "max_failure_rate": 0.2,
+    "throughput_weight": 0.5,
+    "cost_weight": 0.5
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_calls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    model TEXT NOT NULL,
+    provider TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    cost REAL,
+    latency_ms REAL,
+    ttft_ms REAL,
+    success INTEGER NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS llm_calls_model_ts ON llm_calls (model, ts);
+"""
+
+PERCENTILES = (50, 90, 99)
+
+_connection = None
+_connection_path = None
+_lock = threading.Lock()
+
+def _ledger_config() -> dict:
+    return {**DEFAULT_LEDGER_CONFIG, **get_config().get('ledger', {})}
+
+def _get_connection():
+    """Return the shared connection, (re)opening it if the configured path changed."""
+    global _connection, _connection_path
+    ledger_config = _ledger_config()
+    if not ledger_config['enabled']:
+        return None
+    path = state_path(ledger_config['path'])
+    if _connection is None or path != _connection_path:
+        if _connection is not None:
+            _connection.close()
+        _connection = sqlite3.connect(path, check_same_thread=False)
+        _connection.executescript(SCHEMA)
+        _connection_path = path
+    return _connection
+
+def record_call(model_name: str, provider: str, usage: dict, latency_ms: float,
+                ttft_ms: float = None, error: str = None) -> None:
+    """
+    Append one chat completion call to the ledger.
+
+    usage is the dict built by chat_completion (None for failed calls).
+    ttft_ms is None for models with "nostream". Errors writing the ledger
+    are logged and never propagate to the caller.
+    """
+    usage = usage or {}
+    try:
+        with _lock:
+            connection = _get_connection()
+            if connection is None:
+                return
+            with connection:
+                connection.execute(
+                    "INSERT INTO llm_calls (ts, model, provider, prompt_tokens, completion_tokens, "
+                    "total_tokens, cost, latency_ms, ttft_ms, success, error) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (time.time(), model_name, provider, usage.get('prompt_tokens'),
+                     usage.get('completion_tokens'), usage.get('total_tokens'), usage.get('cost'),
+                     latency_ms, ttft_ms, 0 if error else 1, error)
+                )
+    except Exception as e:
+        logger.error(f"Failed to record LLM call in ledger: {str(e)}")
+
+def _percentile(sorted_values: list, pct: float):
+    """Linear-interpolated percentile of an already sorted list (None if empty)."""
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+def _summarize(values: list) -> dict:
+    values = sorted(v for v in values if v is not None)
+    summary = {f"p{pct}": _percentile(values, pct) for pct in PERCENTILES}
+    summary["mean"] = sum(values) / len(values) if values else None
+    return summary
+
+def model_stats(model_name: str = None, since: float = None, window: int = None) -> dict:
+    """
+    Return per-model call statistics from the ledger.
+
+    Args:
+        model_name: Only include this model
+        since: Only include calls after this unix timestamp
+        window: Only include each model's most recent N calls
+
+    Returns:
+        {model: {"provider", "calls", "failures", "failure_rate", "total_cost",
+                 "latency_ms", "ttft_ms", "cost", "throughput_tps"}}
+        where the last four are {"p50", "p90", "p99", "mean"} summaries and
+        throughput is completion tokens per second of latency.
+    """
+    columns = "model, provider, completion_tokens, cost, latency_ms, ttft_ms, success"
+    conditions, params = [], []
+    if model_name is not None:
+        conditions.append("model = ?")
+        params.append(model_name)
+    if since is not None:
+        conditions.append("ts >= ?")
+        params.append(since)
+    where = " WHERE " + " AND ".join(conditions) if conditions else ""
+    if window is None:
+        query = f"SELECT {columns} FROM llm_calls{where}"
+    else:
+        # The window is applied in SQL (using the (model, ts) index), so the
+        # cost does not grow with the size of the ledger
+        query = (
+            f"SELECT {columns} FROM ("
+            f"SELECT {columns}, ROW_NUMBER() OVER (PARTITION BY model ORDER BY ts DESC) AS recent "
+            f"FROM llm_calls{where}) WHERE recent <= ?"
+        )
+        params.append(window)
+
+    with _lock:
+        connection = _get_connection()
+        if connection is None:
+            return {}
+        rows = connection.execute(query, params).fetchall()
+
+    calls_by_model = {}
+    for row in rows:
+        calls_by_model.setdefault(row[0], []).append(row)
+
+    stats = {}
+    for model, calls in calls_by_model.items():
+        successful = [c for c in calls if c[6]]
+        failures = len(calls) - len(successful)
+        stats[model] = {
+            "provider": calls[0][1],
+            "calls": len(calls),
+            "failures": failures,
+            "failure_rate": failures / len(calls),
+            "total_cost": sum(c[3] or 0 for c in successful),
+            "latency_ms": _summarize([c[4] for c in successful]),
+            "ttft_ms": _summarize([c[5] for c in successful]),
+            "cost": _summarize([c[3] for c in successful]),
+            "throughput_tps": _summarize([
+                c[2] / (c[4] / 1000) for c in successful if c[2] and c[4]
+            ])
+        }
+    return stats
+
+def choose_model(candidates: list) -> str:
+    """
+    Pick the candidate model with the best observed throughput, failure rate and cost.
+
+    Uses the "model_selection" section of config.json. Each model with enough
+    recent calls and an acceptable failure rate is scored as
+    (1 - failure_rate) * (throughput_weight * normalized median throughput +
+    cost_weight * (1 - normalized median cost)). Returns None if no candidate
+    has enough data.
+    """
+    selection = {**DEFAULT_SELECTION_CONFIG, **get_config().get('model_selection', {})}
+    stats = model_stats(window=selection['window'])
+    eligible = {
+        model: entry for model, entry in stats.items()
+        if model in candidates
+        and entry['calls'] >= selection['min_calls']
+        and entry['failure_rate'] <= selection['max_failure_rate']
+        and entry['throughput_tps']['p50'] is not None
+    }
+    if not eligible:
+        return None
+
+    max_throughput = max(s['throughput_tps']['p50'] for s in eligible.values()) or 1
+    max_cost = max(s['cost']['p50'] or 0 for s in eligible.values()) or 1
+
+    def score(model):
+        s = eligible[model]
+        throughput = s['throughput_tps']['p50'] / max_throughput
+        cost = (s['cost']['p50'] or 0) / max_cost
+        return (1 - s['failure_rate']) * (
+            selection['throughput_weight'] * throughput + selection['cost_weight'] * (1 - cost)
+        )
+
+    best = max(eligible, key=score)
+    logger.info(f"Selected model {best} from observed performance")
+    return best